@@ -1,9 +1,17 @@
 import os
-import math
-import pandas as pd
 import ttkbootstrap as tb
-from tkinter import filedialog, messagebox, Toplevel, Text, Scrollbar, RIGHT, Y, END, Canvas, Frame
+from tkinter import filedialog, messagebox, Toplevel, Text, Scrollbar, RIGHT, Y, END, Canvas, Frame, BooleanVar
 from ttkbootstrap.constants import *
+from distribution_engine import analyze, parse_capacity, capacity_matrix, stream_plan
+from distribution_scheduler import schedule, STRATEGIES
+from distribution_export import export_distribution, export_stream, EXPORT_FORMATS
+from distribution_state import load_state, incremental_plan, export_changed
+from attendance_documents import generate_documents
+from excel_input import sheet_names, read_columns, load_sheet, iter_chunks, count_rows
+from background_jobs import BackgroundJob, format_rate
+from run_metrics import NULL_METRICS, profiled
+
+OUTPUT_FOLDER = "Exam_Distribution"
 
 
 class MultiCenterExamDistributor:
@@ -20,6 +28,7 @@ class MultiCenterExamDistributor:
         self.round_times = []
         self.centers = []
         self.analyzed = None
+        self.job = None
 
         self.build_ui()
 
@@ -46,7 +55,16 @@ class MultiCenterExamDistributor:
 
         self.sheet_combo = tb.Combobox(style_frame, state="readonly", width=50)
         self.sheet_combo.pack(pady=5)
-        self.sheet_combo.bind("<<ComboboxSelected>>", lambda e: setattr(self, 'sheet_name', self.sheet_combo.get()))
+        self.sheet_combo.bind("<<ComboboxSelected>>", lambda e: self.select_sheet(self.sheet_combo.get()))
+
+        # Keep the previous distribution and only place new / moved examinees
+        keep_frame = tb.Frame(style_frame)
+        keep_frame.pack(pady=5)
+        self.keep_var = BooleanVar(value=False)
+        tb.Checkbutton(keep_frame, text="Keep previous assignments", variable=self.keep_var).pack(side="left", padx=5)
+        tb.Label(keep_frame, text="Examinee ID Column:").pack(side="left")
+        self.id_combo = tb.Combobox(keep_frame, state="readonly", width=30)
+        self.id_combo.pack(side="left", padx=5)
 
         # Rounds
         rounds_frame = tb.Labelframe(style_frame, text="Rounds Per Day", padding=10)
@@ -70,9 +88,64 @@ class MultiCenterExamDistributor:
         self.center_inputs_frame = tb.Frame(style_frame)
         self.center_inputs_frame.pack(fill="x", pady=5)
 
+        # Scheduling strategy
+        schedule_frame = tb.Labelframe(style_frame, text="Scheduling", padding=10)
+        schedule_frame.pack(fill="x", pady=10)
+        tb.Label(schedule_frame, text="Strategy:").pack(side="left")
+        self.strategy_combo = tb.Combobox(schedule_frame, state="readonly", width=12, values=STRATEGIES)
+        self.strategy_combo.current(0)
+        self.strategy_combo.pack(side="left", padx=5)
+        tb.Label(schedule_frame, text="Keep Together (columns, comma separated):").pack(side="left")
+        self.group_entry = tb.Entry(schedule_frame, width=30)
+        self.group_entry.pack(side="left", padx=5)
+        tb.Label(schedule_frame, text="Time Budget (s):").pack(side="left")
+        self.budget_entry = tb.Entry(schedule_frame, width=5)
+        self.budget_entry.insert(0, "5")
+        self.budget_entry.pack(side="left", padx=5)
+
         # Actions
         tb.Button(style_frame, text="Analyze and Preview Report", command=self.preview_report, bootstyle=SUCCESS).pack(pady=10)
-        tb.Button(style_frame, text="Generate Files", command=self.export_files, bootstyle=WARNING).pack(pady=5)
+        export_frame = tb.Frame(style_frame)
+        export_frame.pack(pady=5)
+        tb.Label(export_frame, text="Output Format:").pack(side="left")
+        self.format_combo = tb.Combobox(export_frame, state="readonly", width=8, values=EXPORT_FORMATS)
+        self.format_combo.current(0)
+        self.format_combo.pack(side="left", padx=5)
+        tb.Label(export_frame, text="Workers:").pack(side="left")
+        self.workers_entry = tb.Entry(export_frame, width=5)
+        self.workers_entry.insert(0, "1")
+        self.workers_entry.pack(side="left", padx=5)
+        # Reads and writes the sheet in chunks instead of loading it whole
+        self.stream_var = BooleanVar(value=False)
+        tb.Checkbutton(export_frame, text="Stream rows (large sheets)", variable=self.stream_var).pack(side="left", padx=5)
+        tb.Button(export_frame, text="Generate Files", command=self.export_files, bootstyle=WARNING).pack(side="left")
+
+        # Attendance sheets (from the Word template) and QR admission cards
+        documents_frame = tb.Labelframe(style_frame, text="Attendance Sheets & Admission Cards", padding=10)
+        documents_frame.pack(fill="x", pady=10)
+        self.document_combos = {}
+        for key, label in (("arabic", "Arabic Name:"), ("english", "English Name:"), ("national_id", "National ID:"),
+                           ("code", "Attendance Code:")):
+            tb.Label(documents_frame, text=label).pack(side="left")
+            combo = tb.Combobox(documents_frame, state="readonly", width=16)
+            combo.pack(side="left", padx=5)
+            self.document_combos[key] = combo
+        tb.Label(documents_frame, text="Assessment:").pack(side="left")
+        self.assessment_entry = tb.Entry(documents_frame, width=20)
+        self.assessment_entry.pack(side="left", padx=5)
+        tb.Button(documents_frame, text="Generate Sheets & Cards", command=self.make_documents,
+                  bootstyle=WARNING).pack(side="left")
+
+        # Progress of the running job
+        progress_frame = tb.Frame(style_frame)
+        progress_frame.pack(fill="x", pady=5)
+        self.progress_bar = tb.Progressbar(progress_frame, maximum=100, bootstyle=INFO)
+        self.progress_bar.pack(side="left", fill="x", expand=True, padx=(0, 10))
+        self.progress_label = tb.Label(progress_frame, text="", width=60)
+        self.progress_label.pack(side="left")
+        self.cancel_button = tb.Button(progress_frame, text="Cancel", bootstyle=DANGER,
+                                       command=self.cancel_job, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
 
         tb.Label(style_frame, text="Created by Eng. Firas Kiftaro — Have a nice day!",
                  font=("Arial", 9, "italic"), bootstyle=SECONDARY).pack(pady=10)
@@ -82,15 +155,28 @@ class MultiCenterExamDistributor:
         if not path:
             return
         try:
-            xls = pd.ExcelFile(path)
+            names = sheet_names(path)
             self.excel_path = path
-            self.sheet_combo['values'] = xls.sheet_names
+            self.sheet_combo['values'] = names
             self.sheet_combo.current(0)
-            self.sheet_name = xls.sheet_names[0]
+            self.select_sheet(names[0])
             self.file_label.config(text=os.path.basename(path))
         except Exception as e:
             messagebox.showerror("Error", f"Could not read Excel: {e}")
 
+    def select_sheet(self, name):
+        self.sheet_name = name
+        try:
+            columns = [str(c) for c in read_columns(self.excel_path, name)]
+        except Exception:
+            columns = []
+        self.id_combo['values'] = columns
+        self.id_combo.set("")
+        # Blank first entry: the column is optional
+        for combo in self.document_combos.values():
+            combo['values'] = [""] + columns
+            combo.set("")
+
     def set_rounds(self):
         for widget in self.round_frame.winfo_children():
             widget.destroy()
@@ -170,9 +256,60 @@ class MultiCenterExamDistributor:
         except ValueError:
             messagebox.showerror("Error", "Invalid number of labs.")
 
+    def run_job(self, title, work, on_done, error_title):
+        if self.job and self.job.running:
+            messagebox.showwarning("Busy", "Please wait for the current job to finish or cancel it.")
+            return
+
+        def finished():
+            self.cancel_button.config(state="disabled")
+
+        def done(result):
+            finished()
+            on_done(result)
+
+        def failed(e):
+            finished()
+            self.progress_label.config(text="")
+            messagebox.showerror(error_title, str(e))
+
+        def cancelled():
+            finished()
+            self.progress_label.config(text=f"{title} cancelled.")
+
+        self.progress_bar['value'] = 0
+        self.progress_label.config(text=f"{title}...")
+        self.cancel_button.config(state="normal")
+        self.job = BackgroundJob(self.root, work, on_done=done, on_error=failed,
+                                 on_progress=self.show_progress, on_cancel=cancelled).start()
+
+    def show_progress(self, done, total, stage, elapsed, detail=None):
+        if stage:
+            self.progress_label.config(text=f"{stage}...")
+            return
+        if total:
+            self.progress_bar['value'] = 100 * done / total
+        self.progress_label.config(text=format_rate(done, total, elapsed))
+
+    def cancel_job(self):
+        if self.job:
+            self.job.cancel()
+            self.progress_label.config(text="Cancelling after the current batch...")
+
     def preview_report(self):
         try:
-            self.analyze_distribution()
+            labs = self.collect_labs()
+            options = self.schedule_options()
+            id_col = self.incremental_column(options)
+            stream = self.stream_rows(id_col, options)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        def show(analyzed):
+            self.analyzed = analyzed
+            self.progress_bar['value'] = 100
+            self.progress_label.config(text="Analysis complete.")
             win = Toplevel(self.root)
             win.title("Distribution Report")
             win.geometry("800x600")
@@ -182,116 +319,172 @@ class MultiCenterExamDistributor:
             scrollbar.pack(side=RIGHT, fill=Y)
             text.config(yscrollcommand=scrollbar.set)
             text.insert(END, self.analyzed['report'])
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
 
-    def analyze_distribution(self):
-        df = pd.read_excel(self.excel_path, sheet_name=self.sheet_name)
-        total_examinees = len(df)
+        self.run_job("Analyzing", profiled("analyze", lambda ctx, metrics: self.analyze_distribution(
+            labs, ctx, id_col, options, metrics, stream)), show, "Error")
+
+    def collect_labs(self):
         all_labs = []
         for center in self.centers:
             cname = center['name'].get()
             clink = center['link'].get()
             for lab in center['labs']:
                 labname = lab[0].get()
-                cap = int(lab[1].get())
+                # "30", or one capacity per round: "30/25/30"
+                cap = parse_capacity(lab[1].get())
                 all_labs.append((cname, labname, cap, clink))
-
-        rounds = self.rounds_per_day
-        capacity_per_round = sum([l[2] for l in all_labs])
-        daily_capacity = rounds * capacity_per_round
-        days_needed = math.ceil(total_examinees / daily_capacity)
-        summary = {d: [0]*rounds for d in range(1, days_needed+1)}
-
-        report = []
-        report.append("Exam Distribution Summary")
-        report.append("=========================")
-        report.append(f"Total Examinees       : {total_examinees}")
-        report.append(f"Number of Labs        : {len(all_labs)}")
-        report.append(f"Rounds per Day        : {rounds}")
-        report.append(f"Capacity Per Round    : {capacity_per_round}")
-        report.append(f"Total Daily Capacity  : {daily_capacity}")
-        report.append(f"Recommended Days      : {days_needed}\n")
-
-        round_headers = [f"Round {i+1}" for i in range(rounds)]
-        report.append("Distribution Table (Per Day & Round):")
-        report.append("-" * (5 + 12 * rounds))
-        report.append("Day".ljust(8) + ''.join(r.ljust(12) for r in round_headers))
-        report.append("-" * (5 + 12 * rounds))
-
-        i = 0
-        for d in range(1, days_needed+1):
-            for r in range(1, rounds+1):
-                used = 0
-                for lab in all_labs:
-                    for _ in range(lab[2]):
-                        if i >= total_examinees:
-                            break
-                        i += 1
-                        used += 1
-                summary[d][r-1] = used
-                if i >= total_examinees:
-                    break
-            if i >= total_examinees:
-                break
-
-        for day, counts in summary.items():
-            report.append(str(day).ljust(8) + ''.join(str(c).ljust(12) for c in counts))
-
-        report.append("\n© 2025 Firas Kiftaro. All rights reserved.\n")
-        self.analyzed = {
-            "df": df,
-            "labs": all_labs,
-            "rounds": rounds,
-            "days": days_needed,
-            "summary": summary,
-            "report": "\n".join(report)
-        }
+        return all_labs
+
+    def schedule_options(self):
+        group_by = [c.strip() for c in self.group_entry.get().split(",") if c.strip()]
+        return {"strategy": self.strategy_combo.get(), "group_by": group_by,
+                "time_budget": float(self.budget_entry.get() or 5)}
+
+    def incremental_column(self, options):
+        # ID column to key the saved assignment on, or None for a fresh fill.
+        # Kept seats are topped up in fill order, so this is sequential only.
+        if not self.keep_var.get():
+            return None
+        if not self.id_combo.get():
+            raise ValueError("Choose the Examinee ID column to keep previous assignments.")
+        if options["strategy"] != "sequential" or options["group_by"]:
+            raise ValueError("Keeping previous assignments only works with the sequential strategy, "
+                             "without keep-together columns.")
+        return self.id_combo.get()
+
+    def stream_rows(self, id_col, options):
+        # Streaming seats rows in sheet order, so it only goes with a plain
+        # sequential fill
+        if not self.stream_var.get():
+            return False
+        if id_col is not None or options["strategy"] != "sequential" or options["group_by"]:
+            raise ValueError("Streaming rows only works with the sequential strategy, without "
+                             "keep-together columns or keeping previous assignments.")
+        return True
+
+    def analyze_distribution(self, labs, ctx=None, id_col=None, options=None, metrics=NULL_METRICS, stream=False):
+        # Runs on the worker thread: no widget access here
+        if stream:
+            if ctx:
+                ctx.progress(0, stage="Counting rows")
+            with metrics.stage("analyze.count_rows"):
+                total = count_rows(self.excel_path, self.sheet_name)
+            metrics.count("rows", total)
+            with metrics.stage("analyze.assign_seats"):
+                plan = stream_plan(total, capacity_matrix(labs, self.rounds_per_day), self.rounds_per_day)
+                analyzed = analyze(None, labs, self.rounds_per_day, plan)
+            analyzed["options"] = options
+            analyzed["stream"] = True
+            return analyzed
+        if ctx:
+            ctx.progress(0, stage="Reading workbook")
+        with metrics.stage("analyze.read_workbook"):
+            df = load_sheet(self.excel_path, self.sheet_name)
+        metrics.count("rows", len(df))
+        if ctx:
+            ctx.progress(0, stage="Assigning seats")
+        if id_col is None:
+            with metrics.stage("analyze.assign_seats"):
+                if not options or options["strategy"] == "sequential" and not options["group_by"]:
+                    analyzed = analyze(df, labs, self.rounds_per_day)
+                else:
+                    df, plan = schedule(df, labs, self.rounds_per_day, **options)
+                    analyzed = analyze(df, labs, self.rounds_per_day, plan)
+            analyzed["options"] = options
+            return analyzed
+        with metrics.stage("analyze.assign_seats"):
+            df, plan, stats = incremental_plan(df, labs, self.rounds_per_day, id_col, load_state(OUTPUT_FOLDER))
+            analyzed = analyze(df, labs, self.rounds_per_day, plan)
+        analyzed["id_column"] = id_col
+        analyzed["options"] = options
+        analyzed["report"] += (f"\nKept in place: {stats['kept']}   Moved: {stats['moved']}   "
+                               f"New: {stats['new']}   Withdrawn: {stats['withdrawn']}\n")
+        return analyzed
+
+    def current_analysis(self, id_col, options, stream=False):
+        # The last analysis, unless it was made with different settings
+        analyzed = self.analyzed
+        if analyzed and (analyzed.get("id_column") != id_col or analyzed.get("stream", False) != stream or
+                         analyzed.get("options") != options):
+            return None
+        return analyzed
 
     def export_files(self):
         try:
-            if not self.analyzed:
-                self.analyze_distribution()
-            df = self.analyzed["df"]
-            labs = self.analyzed["labs"]
-            rounds = self.analyzed["rounds"]
-            days = self.analyzed["days"]
-
-            idx = 0
-            base = "Exam_Distribution"
-            os.makedirs(base, exist_ok=True)
-
-            for d in range(1, days+1):
-                with pd.ExcelWriter(f"{base}/Day_{d}.xlsx") as writer:
-                    for r in range(1, rounds+1):
-                        round_data = []
-                        for cname, lname, cap, clink in labs:
-                            for _ in range(cap):
-                                if idx >= len(df):
-                                    break
-                                original_row = df.iloc[idx].copy()
-                                additional_data = {
-                                    "Center": cname,
-                                    "Lab": lname,
-                                    "Day Number": d,
-                                    "Time": f"{self.round_times[r-1][0].get()} - {self.round_times[r-1][1].get()}",
-                                    "Round Number": r,
-                                    "Center Link": clink
-                                }
-                                for col, val in additional_data.items():
-                                    original_row[col] = val
-                                round_data.append(original_row)
-                                idx += 1
-                        if round_data:
-                            pd.DataFrame(round_data).to_excel(writer, sheet_name=f"Round_{r}", index=False)
-                        if idx >= len(df):
-                            break
-                if idx >= len(df):
-                    break
-
-            messagebox.showinfo("Done", f"Files exported to: {base}")
+            options = self.schedule_options()
+            id_col = self.incremental_column(options)
+            stream = self.stream_rows(id_col, options)
+            analyzed = self.current_analysis(id_col, options, stream)
+            labs = None if analyzed else self.collect_labs()
+            times = [(start.get(), end.get()) for start, end in self.round_times]
+            fmt = self.format_combo.get()
+            workers = int(self.workers_entry.get() or 1)
         except Exception as e:
             messagebox.showerror("Export Error", str(e))
+            return
+
+        base = OUTPUT_FOLDER
+
+        def work(ctx, metrics):
+            result = analyzed or self.analyze_distribution(labs, ctx, id_col, options, metrics, stream)
+            if result.get("stream"):
+                ctx.progress(0, result["plan"]["total"])
+                return result, export_stream(iter_chunks(self.excel_path, self.sheet_name), result["labs"],
+                                             result["plan"], times, base, fmt, progress=ctx.progress,
+                                             metrics=metrics)
+            ctx.progress(0, len(result["df"]))
+            if id_col is not None:
+                return result, export_changed(result["df"], result["labs"], result["plan"], times, id_col,
+                                              base, fmt, workers, progress=ctx.progress, metrics=metrics)
+            return result, export_distribution(result["df"], result["labs"], result["plan"], times,
+                                               base, fmt, workers, progress=ctx.progress, metrics=metrics)
+
+        def done(outcome):
+            self.analyzed, result = outcome
+            peak = result["peak_rss_mb"]
+            peak_text = f"\nPeak memory: {peak:.0f} MB" if peak is not None else ""
+            changed_text = ""
+            if "days_written" in result:
+                written = ", ".join(map(str, result["days_written"])) or "none"
+                changed_text = f"\nDays rewritten: {written}"
+            messagebox.showinfo("Done", f"Files exported to: {base}{changed_text}{peak_text}")
+
+        self.run_job("Exporting", profiled("export", work), done, "Export Error")
+
+    def make_documents(self):
+        try:
+            options = self.schedule_options()
+            id_col = self.incremental_column(options)
+            if self.stream_rows(id_col, options):
+                raise ValueError("Attendance sheets and admission cards need the whole sheet; "
+                                 "turn off 'Stream rows'.")
+            analyzed = self.current_analysis(id_col, options)
+            labs = None if analyzed else self.collect_labs()
+            times = [(start.get(), end.get()) for start, end in self.round_times]
+            columns = {key: combo.get() or None for key, combo in self.document_combos.items()}
+            assessment = self.assessment_entry.get().strip()
+            workers = int(self.workers_entry.get() or 1)
+        except Exception as e:
+            messagebox.showerror("Documents Error", str(e))
+            return
+
+        base = OUTPUT_FOLDER
+
+        def work(ctx, metrics):
+            result = analyzed or self.analyze_distribution(labs, ctx, id_col, options, metrics)
+            ctx.progress(0, stage="Writing sheets and cards")
+            return result, generate_documents(result["df"], result["labs"], result["plan"], times, base,
+                                              columns["arabic"], columns["english"], columns["national_id"],
+                                              columns["code"], assessment=assessment, workers=workers,
+                                              progress=ctx.progress, metrics=metrics)
+
+        def done(outcome):
+            self.analyzed, made = outcome
+            cards = f"Admission cards: {made['cards']}" if columns["code"] else \
+                "No admission cards (choose the Attendance Code column)"
+            messagebox.showinfo("Done", f"Attendance sheets: {made['sheets']}\n{cards}\nSaved in: {base}")
+
+        self.run_job("Generating documents", profiled("documents", work), done, "Documents Error")
 
 
 if __name__ == "__main__":
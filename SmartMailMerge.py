@@ -1,83 +1,242 @@
-import os
-import pandas as pd
 import tkinter as tk
 from tkinter import filedialog
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
-import win32com.client as win32
+import os
+import threading
+import time
+from excel_input import read_columns, iter_chunks, estimate_rows
+from background_jobs import BackgroundJob, Cancelled, format_rate
+from mail_attachments import AttachmentIndex, MATCH_MODES, attachment_paths
+from mail_transport import OutlookTransport, SmtpTransport, TRANSPORTS
+from mail_template import MessageTemplate
+from mail_journal import SendJournal, message_key, SENT, FAILED, RESUME_MODES
+from mail_scheduler import SendScheduler
+from run_metrics import NULL_METRICS, profiled
 
 # Log file path
 log_file = "email_log.txt"
 
-def send_email_with_outlook(to_email, subject, arabic_html, english_html, attachment_path):
-    outlook = win32.Dispatch('Outlook.Application')
-    mail = outlook.CreateItem(0)
-    mail.To = to_email
-    mail.Subject = subject
-    mail.HTMLBody = f"""
-    <html>
-        <body>
-            <table border="0" style="width:100%;">
-                <tr>
-                    <td style="width:50%;">
-                        <div dir='ltr' style='text-align:left; font-family:Sakkal Majalla, serif; font-size:14pt;'>
-                            {english_html}
-                        </div>
-                    </td>
-                    <td style="width:50%;">
-                        <div dir='rtl' style='text-align:right; font-family:Sakkal Majalla, serif; font-size:14pt;'>
-                            {arabic_html}
-                        </div>
-                    </td>
-                </tr>
-            </table>
-        </body>
-    </html>
-    """
-    if attachment_path:
-        mail.Attachments.Add(attachment_path)
-    mail.Send()
+# Structured record of sent/failed messages, used to resume interrupted runs
+journal_file = "email_journal.jsonl"
+
+# Currently running send job, if any
+job = None
+
+# Messages shown by the dry-run preview
+preview_count = 5
+
+def make_scheduler(settings):
+    if settings["transport"] == "SMTP":
+        transport = SmtpTransport(
+            settings["smtp_host"], int(settings["smtp_port"] or 587),
+            settings["smtp_user"], settings["smtp_password"], settings["smtp_sender"],
+            security=settings["smtp_security"],
+            connections=int(settings["smtp_connections"] or 4))
+    else:
+        transport = OutlookTransport()
+    return SendScheduler(
+        transport,
+        per_second=float(settings["smtp_rate"]) if settings["smtp_rate"] else None,
+        per_domain=int(settings["per_domain"]) if settings["per_domain"] else None)
+
+def read_settings():
+    # Read every widget here on the Tk thread; the worker only sees plain values
+    return {
+        "excel": excel_path.get(),
+        "folder": folder_path.get(),
+        "common": common_path.get().strip(),
+        "match_col": match_col.get(),
+        "email_col": email_col.get(),
+        "match_mode": match_mode.get(),
+        "subject": subject_entry.get().strip(),
+        "arabic": arabic_box.get("1.0", "end").strip(),
+        "english": english_box.get("1.0", "end").strip(),
+        "resume_mode": resume_mode.get(),
+        "transport": transport_name.get(),
+        "smtp_host": smtp_host.get().strip(),
+        "smtp_port": smtp_port.get().strip(),
+        "smtp_user": smtp_user.get().strip(),
+        "smtp_password": smtp_password.get(),
+        "smtp_sender": smtp_sender.get().strip(),
+        "smtp_security": smtp_security.get(),
+        "smtp_connections": smtp_connections.get().strip(),
+        "smtp_rate": smtp_rate.get().strip(),
+        "per_domain": per_domain.get().strip(),
+    }
 
 def send_emails():
+    global job
+    if job and job.running:
+        return
+    settings = read_settings()
     spinner_label.pack()
+    progress_label.config(text="")
     status_label.config(text="", foreground="green")
     preview_box.delete("1.0", tk.END)
-    with open(log_file, "w", encoding="utf-8") as log:
-        try:
-            df = pd.read_excel(excel_path.get())
-            for _, row in df.iterrows():
-                match_value = str(row[match_col.get()]).strip()
-                to_email = row[email_col.get()]
-                matched_file = next((f for f in os.listdir(folder_path.get()) if match_value in f), None)
-                if matched_file:
-                    attachment_path = os.path.join(folder_path.get(), matched_file)
-                    send_email_with_outlook(
-                        to_email,
-                        subject_entry.get().strip(),
-                        arabic_box.get("1.0", "end").strip().replace("\n", "<br>"),
-                        english_box.get("1.0", "end").strip().replace("\n", "<br>"),
-                        attachment_path
-                    )
-                    msg = f"✅ Email sent to: {to_email} with file: {matched_file}"
-                else:
-                    msg = f"⚠️ No attachment found for: {match_value} (email: {to_email})"
+    send_button.config(state="disabled")
+    cancel_button.config(state="normal")
+    job = BackgroundJob(root, profiled("send", lambda ctx, metrics: send_all(ctx, settings, metrics)),
+                        on_done=lambda _: finish_sending("✅ All emails processed. See log below.", "green"),
+                        on_error=lambda e: finish_sending(f"❌ Error: {str(e)}", "red"),
+                        on_cancel=lambda: finish_sending("⏹ Sending cancelled. See log below.", "orange"),
+                        on_progress=show_progress, on_log=append_log).start()
+
+def preview_messages():
+    global job
+    if job and job.running:
+        return
+    settings = read_settings()
+
+    def render(ctx):
+        df = next(iter_chunks(settings["excel"], chunk_rows=preview_count), None)
+        if df is None:
+            return
+        template = MessageTemplate(settings["subject"], settings["english"], settings["arabic"], df.columns)
+        emails = df[settings["email_col"]].head(preview_count).tolist()
+        for to_email, (subject, html) in zip(emails, template.preview(df, preview_count)):
+            ctx.log(f"To: {to_email}\nSubject: {subject}\n{html.strip()}\n{'-' * 80}")
+
+    preview_box.delete("1.0", tk.END)
+    status_label.config(text="", foreground="green")
+    job = BackgroundJob(root, render, on_log=append_log,
+                        on_done=lambda _: status_label.config(text=f"👁 Showing the first {preview_count} messages (nothing sent).", foreground="green"),
+                        on_error=lambda e: status_label.config(text=f"❌ Error: {str(e)}", foreground="red")).start()
+
+def send_all(ctx, settings, metrics=NULL_METRICS):
+    scheduler = make_scheduler(settings)
+    scheduler.open()
+    journal = SendJournal(journal_file)
+    lock = threading.Lock()
+    finished = [0]
+    skipped = [0]
+
+    with open(log_file, "a", encoding="utf-8") as log:
+        log.write(f"--- Run started {time.strftime('%Y-%m-%d %H:%M:%S')} ({settings['resume_mode']}) ---\n")
+
+        def record(msg):
+            # Called from the transport's threads as messages complete
+            with lock:
                 log.write(msg + "\n")
-                preview_box.insert(tk.END, msg + "\n")
-            status_label.config(text="✅ All emails processed. See log below.", foreground="green")
+                finished[0] += 1
+            ctx.log(msg)
+
+        def on_sent(future, to_email, matched_file, key):
+            if future.cancelled():
+                record(f"⏹ Not sent (cancelled): {to_email}")
+            elif future.exception() is not None:
+                metrics.count("messages_failed")
+                journal.record(key, to_email, matched_file, FAILED, str(future.exception()))
+                record(f"❌ Failed to send to: {to_email} with file: {matched_file} ({future.exception()})")
+            else:
+                metrics.count("messages_sent")
+                journal.record(key, to_email, matched_file, SENT)
+                record(f"✅ Email sent to: {to_email} with file: {matched_file}")
+
+        try:
+            # Compile once; an unknown {{column}} fails here, before anything is sent
+            template = MessageTemplate(settings["subject"], settings["english"], settings["arabic"],
+                                       read_columns(settings["excel"]))
+            # The sheet is streamed in chunks holding only the columns used, so
+            # memory does not grow with the number of rows
+            needed = list(dict.fromkeys([settings["match_col"], settings["email_col"]] + template.columns))
+            total = estimate_rows(settings["excel"])
+            seen = 0
+            common = settings["common"]
+            if common and not os.path.isfile(common):
+                raise ValueError(f"Common attachment not found: {common}")
+            with metrics.stage("send.scan_attachments"):
+                index = AttachmentIndex(settings["folder"], settings["match_mode"])
+            for df in metrics.iterate("send.read_workbook", iter_chunks(settings["excel"], 0, needed)):
+                seen += len(df)
+                if total is not None and seen > total:
+                    total = seen
+                metrics.count("rows", len(df))
+                keys = [str(v).strip() for v in df[settings["match_col"]].tolist()]
+                emails = df[settings["email_col"]].tolist()
+                with metrics.stage("send.scan_attachments"):
+                    index.prepare(keys)
+                rendered = metrics.iterate("send.render", template.render_rows(df))
+                for match_value, to_email, (subject, html) in zip(keys, emails, rendered):
+                    files = index.lookup(match_value)
+                    if len(files) > 1:
+                        metrics.count("ambiguous")
+                        record(f"⚠️ Ambiguous match for: {match_value} (email: {to_email}) - {len(files)} files: {', '.join(files)}")
+                    elif files:
+                        attachment_path = index.path(files[0])
+                        key = message_key(to_email, attachment_path)
+                        paths = [attachment_path, common] if common else attachment_path
+                        if journal.should_skip(key, settings["resume_mode"]):
+                            metrics.count("messages_skipped")
+                            with lock:
+                                finished[0] += 1
+                                skipped[0] += 1
+                        else:
+                            if metrics.enabled:
+                                metrics.count("attachment_bytes", sum(map(os.path.getsize, attachment_paths(paths))))
+                            # With Outlook this is the send itself; with SMTP it
+                            # waits only when the connection pool is saturated
+                            with metrics.stage("send.submit"):
+                                future = scheduler.submit(to_email, subject, html, paths)
+                            future.add_done_callback(lambda f, to=to_email, name=files[0], k=key: on_sent(f, to, name, k))
+                    else:
+                        metrics.count("no_attachment")
+                        record(f"⚠️ No attachment found for: {match_value} (email: {to_email})")
+                    ctx.progress(finished[0], total, detail=scheduler.describe())
+            total = seen
+            with metrics.stage("send.drain"):
+                scheduler.close()
+            # SMTP encodes each attachment file once and reuses it across messages
+            cache = getattr(scheduler.transport, "attachments", None)
+            if cache is not None:
+                stats = cache.stats()
+                for name in ("hits", "misses", "evictions", "bytes_read"):
+                    metrics.count(f"attachment_cache_{name}", stats[name])
+                log.write(f"📎 Attachments: {stats['misses']} encoded, {stats['hits']} reused from cache"
+                          f" ({stats['bytes_read'] / 1048576:.1f} MB read)\n")
+                ctx.log(f"📎 Attachments: {stats['misses']} encoded, {stats['hits']} reused from cache")
+            if skipped[0]:
+                record(f"⏭ Skipped {skipped[0]} message(s) per the journal ({settings['resume_mode']})")
+            if scheduler.dead_letters:
+                record(f"☠ {len(scheduler.dead_letters)} message(s) failed permanently; use 'Retry failed only' after fixing them")
+            ctx.progress(finished[0], total, detail=scheduler.describe())
+        except Cancelled:
+            scheduler.close(cancel=True)
+            log.write("⏹ Cancelled by user\n")
+            raise
         except Exception as e:
-            error_msg = f"❌ Error: {str(e)}"
-            status_label.config(text=error_msg, foreground="red")
-            log.write(error_msg + "\n")
-            preview_box.insert(tk.END, error_msg + "\n")
+            scheduler.close(cancel=True)
+            log.write(f"❌ Error: {str(e)}\n")
+            raise
         finally:
-            spinner_label.pack_forget()
+            journal.close()
+
+def show_progress(done, total, stage, elapsed, detail=None):
+    text = format_rate(done, total, elapsed)
+    progress_label.config(text=f"{text}\n{detail}" if detail else text)
+
+def append_log(msg):
+    preview_box.insert(tk.END, msg + "\n")
+    preview_box.see(tk.END)
+
+def finish_sending(text, color):
+    status_label.config(text=text, foreground=color)
+    if color == "red":
+        append_log(text)
+    spinner_label.pack_forget()
+    send_button.config(state="normal")
+    cancel_button.config(state="disabled")
+
+def cancel_sending():
+    if job:
+        job.cancel()
+        status_label.config(text="Stopping after the current message...", foreground="orange")
 
 def browse_excel():
     path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx *.xls")])
     if path:
         excel_path.set(path)
-        df = pd.read_excel(path)
-        cols = df.columns.tolist()
+        cols = read_columns(path)
         match_col_menu['values'] = cols
         email_col_menu['values'] = cols
 
@@ -86,6 +245,11 @@ def browse_folder():
     if path:
         folder_path.set(path)
 
+def browse_common():
+    path = filedialog.askopenfilename()
+    if path:
+        common_path.set(path)
+
 def force_arabic_rtl(*args):
     arabic_box.tag_add("rtl", "1.0", "end")
 
@@ -113,8 +277,21 @@ root.geometry("1600x1300")
 
 excel_path = tk.StringVar()
 folder_path = tk.StringVar()
+common_path = tk.StringVar()
 match_col = tk.StringVar()
 email_col = tk.StringVar()
+match_mode = tk.StringVar(value=MATCH_MODES[0])
+transport_name = tk.StringVar(value=TRANSPORTS[0])
+smtp_host = tk.StringVar()
+smtp_port = tk.StringVar(value="587")
+smtp_user = tk.StringVar()
+smtp_password = tk.StringVar()
+smtp_sender = tk.StringVar()
+smtp_security = tk.StringVar(value="starttls")
+smtp_connections = tk.StringVar(value="4")
+smtp_rate = tk.StringVar()
+resume_mode = tk.StringVar(value=RESUME_MODES[0])
+per_domain = tk.StringVar()
 
 # Header
 tb.Label(root, text="📨 Smart Attachment Email Sender", font=("Segoe UI", 22, "bold")).pack(pady=(10, 5))
@@ -135,6 +312,10 @@ tb.Label(file_frame, text="Attachments Folder:", font=("Arial", 11)).grid(row=1,
 tb.Entry(file_frame, textvariable=folder_path, width=60).grid(row=1, column=1, padx=5, pady=5)
 tb.Button(file_frame, text="Browse", command=browse_folder).grid(row=1, column=2, padx=5)
 
+tb.Label(file_frame, text="Common Attachment (optional):", font=("Arial", 11)).grid(row=2, column=0, sticky="w", padx=5, pady=5)
+tb.Entry(file_frame, textvariable=common_path, width=60).grid(row=2, column=1, padx=5, pady=5)
+tb.Button(file_frame, text="Browse", command=browse_common).grid(row=2, column=2, padx=5)
+
 # Step 2
 column_frame = tb.Labelframe(main_frame, text="Step 2: 🧩 Column Mapping", padding=15)
 column_frame.pack(fill="x", pady=10)
@@ -147,6 +328,10 @@ tb.Label(column_frame, text="Email Column:", font=("Arial", 11)).grid(row=1, col
 email_col_menu = tb.Combobox(column_frame, textvariable=email_col, width=57)
 email_col_menu.grid(row=1, column=1, padx=5, pady=5)
 
+tb.Label(column_frame, text="File Name Match:", font=("Arial", 11)).grid(row=2, column=0, sticky="w", padx=5, pady=5)
+match_mode_menu = tb.Combobox(column_frame, textvariable=match_mode, values=MATCH_MODES, state="readonly", width=57)
+match_mode_menu.grid(row=2, column=1, padx=5, pady=5)
+
 # Step 3
 content_frame = tb.Labelframe(main_frame, text="Step 3: 📝 Email Content", padding=15)
 content_frame.pack(fill="both", pady=10, expand=True)
@@ -154,6 +339,8 @@ content_frame.pack(fill="both", pady=10, expand=True)
 tb.Label(content_frame, text="Email Subject:", font=("Arial", 11)).grid(row=0, column=0, sticky="w", padx=5, pady=5)
 subject_entry = tb.Entry(content_frame, width=70)
 subject_entry.grid(row=0, column=1, columnspan=2, sticky="w", padx=5, pady=5)
+tb.Label(content_frame, text="Use {{Column Name}} to insert a value from the sheet.", font=("Arial", 9),
+         foreground="gray").grid(row=0, column=3, sticky="w", padx=5, pady=5)
 
 tb.Label(content_frame, text="English Message:", font=("Arial", 11)).grid(row=1, column=0, sticky="nw", padx=5, pady=5)
 english_box = tk.Text(content_frame, height=12, width=50, wrap="word", font=("Segoe UI", 11), undo=True, maxundo=-1)
@@ -170,6 +357,36 @@ arabic_box.bind("<KeyRelease>", force_arabic_rtl)
 bind_text_shortcuts(english_box)
 bind_text_shortcuts(arabic_box)
 
+# Step 4
+send_frame = tb.Labelframe(main_frame, text="Step 4: 📡 Sending Method", padding=15)
+send_frame.pack(fill="x", pady=10)
+
+tb.Label(send_frame, text="Send Using:", font=("Arial", 11)).grid(row=0, column=0, sticky="w", padx=5, pady=5)
+tb.Combobox(send_frame, textvariable=transport_name, values=TRANSPORTS, state="readonly", width=15).grid(row=0, column=1, sticky="w", padx=5, pady=5)
+tb.Label(send_frame, text="SMTP Server:", font=("Arial", 11)).grid(row=0, column=2, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_host, width=30).grid(row=0, column=3, padx=5, pady=5)
+tb.Label(send_frame, text="Port:", font=("Arial", 11)).grid(row=0, column=4, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_port, width=6).grid(row=0, column=5, padx=5, pady=5)
+tb.Label(send_frame, text="Security:", font=("Arial", 11)).grid(row=0, column=6, sticky="w", padx=5, pady=5)
+tb.Combobox(send_frame, textvariable=smtp_security, values=("starttls", "ssl", "none"), state="readonly", width=10).grid(row=0, column=7, padx=5, pady=5)
+
+tb.Label(send_frame, text="Username:", font=("Arial", 11)).grid(row=1, column=0, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_user, width=30).grid(row=1, column=1, padx=5, pady=5)
+tb.Label(send_frame, text="Password:", font=("Arial", 11)).grid(row=1, column=2, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_password, show="*", width=30).grid(row=1, column=3, padx=5, pady=5)
+tb.Label(send_frame, text="From:", font=("Arial", 11)).grid(row=1, column=4, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_sender, width=30).grid(row=1, column=5, columnspan=3, sticky="w", padx=5, pady=5)
+
+tb.Label(send_frame, text="Connections:", font=("Arial", 11)).grid(row=2, column=0, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_connections, width=6).grid(row=2, column=1, sticky="w", padx=5, pady=5)
+tb.Label(send_frame, text="Max Emails/Second:", font=("Arial", 11)).grid(row=2, column=2, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=smtp_rate, width=6).grid(row=2, column=3, sticky="w", padx=5, pady=5)
+tb.Label(send_frame, text="Max Per Domain:", font=("Arial", 11)).grid(row=2, column=4, sticky="w", padx=5, pady=5)
+tb.Entry(send_frame, textvariable=per_domain, width=6).grid(row=2, column=5, sticky="w", padx=5, pady=5)
+
+tb.Label(send_frame, text="Previous Runs:", font=("Arial", 11)).grid(row=3, column=0, sticky="w", padx=5, pady=5)
+tb.Combobox(send_frame, textvariable=resume_mode, values=RESUME_MODES, state="readonly", width=20).grid(row=3, column=1, sticky="w", padx=5, pady=5)
+
 # Send Button + Spinner + Status
 button_frame = tb.Frame(main_frame)
 button_frame.pack(pady=20)
@@ -177,10 +394,19 @@ button_frame.pack(pady=20)
 send_button = tb.Button(button_frame, text="🚀 Send Emails", bootstyle=SUCCESS, width=30, command=send_emails)
 send_button.pack()
 
+preview_button = tb.Button(button_frame, text="👁 Preview Messages", bootstyle=INFO, width=30, command=preview_messages)
+preview_button.pack(pady=(5, 0))
+
+cancel_button = tb.Button(button_frame, text="⏹ Cancel", bootstyle=DANGER, width=30, command=cancel_sending, state="disabled")
+cancel_button.pack(pady=(5, 0))
+
 spinner_label = tb.Label(button_frame, text="⏳ Sending emails...", font=("Segoe UI", 10), foreground="blue")
 spinner_label.pack()
 spinner_label.pack_forget()
 
+progress_label = tb.Label(button_frame, text="", font=("Segoe UI", 10))
+progress_label.pack()
+
 status_label = tb.Label(button_frame, text="", font=("Segoe UI", 10), foreground="green")
 status_label.pack()
 
@@ -0,0 +1,450 @@
+import os
+import re
+import hashlib
+import zipfile
+from functools import lru_cache
+from xml.sax.saxutils import escape
+from distribution_engine import capacity_matrix, round_slices, value_runs
+from excel_input import CACHE_DIR, cell_text
+from run_metrics import NULL_METRICS, peak_rss_mb
+
+
+# Attendance sheets and QR admission cards for a finished distribution.
+#
+# Attendance sheets: "Attendance Sheet Template.docx" is read once. Its
+# first table (title, proctor / lab / round, center / day / date, column
+# headings, one row per seat) is split into literal XML pieces around the
+# values that change, so filling a sheet is string joins only: no
+# python-docx, and the template's fonts, borders and right-to-left layout
+# are kept as they are. Every lab of every round gets a sheet with one row
+# per seat up to the lab's capacity, one page each, in
+# Attendance Sheets/Attendance_Day_N.docx.
+#
+# Admission cards: the same card admission-card.js shows (center,
+# assessment, name, national ID, session, QR of the attendance code),
+# eight to an A4 page, in Admission Cards/Cards_Day_N_<center>.pdf. Needs
+# reportlab; QR codes are encoded with the qrcode package when installed
+# (faster), otherwise with reportlab's own encoder. Encoding a QR is most
+# of the cost of a card, so each code's QR is cached as a one pixel per
+# module image, in memory and on disk (CACHE_DIR/qr), and re-running after
+# a change only encodes new codes. Arabic text on the cards needs a
+# TTF font with Arabic glyphs (EXAM_TOOLS_FONT, or Arial on Windows) and
+# is shaped when arabic-reshaper and python-bidi are installed.
+#
+# With workers > 1 the day / center files are built in a process pool;
+# each worker receives the parsed template once.
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Attendance Sheet Template.docx")
+SHEETS_FOLDER = "Attendance Sheets"
+CARDS_FOLDER = "Admission Cards"
+FONT_ENV = "EXAM_TOOLS_FONT"
+QR_CACHE_SIZE = 50000
+
+_TABLE = re.compile(r"<w:tbl>.*?</w:tbl>", re.S)
+_ROW = re.compile(r"<w:tr\b.*?</w:tr>", re.S)
+_CELL = re.compile(r"<w:tc>.*?</w:tc>", re.S)
+_TEXT = re.compile(r"<w:t(?: [^>]*)?>[^<]*</w:t>")
+_MARK = "\x00"
+
+# (row, cell) of the header values in the template's table
+HEADER_FIELDS = {"proctor": (1, 1), "lab": (1, 3), "round": (1, 5), "center": (2, 1), "day": (2, 3), "date": (2, 5)}
+HEADER_ROWS = 4
+SEAT_CELLS = (0, 1, 2)  # seat number, Arabic name, English name
+
+# Starts the next sheet on a new page without adding a blank one when the
+# previous table already filled its page
+PAGE_BREAK = ('<w:p><w:pPr><w:pageBreakBefore/><w:spacing w:before="0" w:after="0"/>'
+              '<w:rPr><w:sz w:val="2"/></w:rPr></w:pPr></w:p>')
+
+
+def _fill_cell(cell, text):
+    # Puts text in the cell's first run (keeping its formatting) and empties
+    # the others; an empty cell gets a run formatted like its paragraph mark
+    value = f'<w:t xml:space="preserve">{text}</w:t>'
+    runs = list(_TEXT.finditer(cell))
+    if runs:
+        parts, last = [], 0
+        for i, m in enumerate(runs):
+            parts.append(cell[last:m.start()])
+            parts.append(value if i == 0 else "<w:t></w:t>")
+            last = m.end()
+        return "".join(parts) + cell[last:]
+    props = re.search(r"<w:pPr>.*?(<w:rPr>.*?</w:rPr>).*?</w:pPr>", cell, re.S)
+    run = f"<w:r>{props.group(1) if props else ''}{value}</w:r>"
+    end = cell.rindex("</w:p>")
+    return cell[:end] + run + cell[end:]
+
+
+def _fill_row(row, cells):
+    # cells: {cell index: text}
+    found = list(_CELL.finditer(row))
+    parts, last = [], 0
+    for i, m in enumerate(found):
+        parts.append(row[last:m.start()])
+        parts.append(_fill_cell(m.group(), cells[i]) if i in cells else m.group())
+        last = m.end()
+    return "".join(parts) + row[last:]
+
+
+def _pieces(xml):
+    # Template text with numbered markers -> (literal pieces, marker number
+    # after each piece but the last)
+    pieces = xml.split(_MARK)
+    return pieces[0::2], [int(i) for i in pieces[1::2]]
+
+
+class AttendanceTemplate:
+    def __init__(self, path=TEMPLATE_FILE):
+        with zipfile.ZipFile(path) as z:
+            self.members = [(info, z.read(info.filename)) for info in z.infolist()]
+        document = dict((info.filename, data) for info, data in self.members)["word/document.xml"].decode("utf-8")
+        table = _TABLE.search(document)
+        if table is None:
+            raise ValueError("The attendance template has no table.")
+        rows = list(_ROW.finditer(table.group()))
+        if len(rows) < HEADER_ROWS + 1:
+            raise ValueError("The attendance template table has no seat rows.")
+        # The template holds several sample tables; only the first one is
+        # used, and the body after it is replaced up to the section settings
+        self.before = document[:table.start()]
+        self.after = document[document.rindex("<w:sectPr"):]
+        spacer = re.match(r"\s*(<w:p\b.*?</w:p>)", document[table.end():], re.S)
+        self.spacer = spacer.group(1) if spacer else "<w:p/>"
+
+        xml = table.group()
+        head = xml[:rows[0].start()]
+        tail = xml[rows[-1].end():]
+        fields = list(HEADER_FIELDS)
+        header_rows = []
+        for n, m in enumerate(rows[:HEADER_ROWS]):
+            cells = {cell: f"{_MARK}{fields.index(name)}{_MARK}"
+                     for name, (row, cell) in HEADER_FIELDS.items() if row == n}
+            header_rows.append(_fill_row(m.group(), cells))
+        self.header = _pieces(head + "".join(header_rows))
+        self.fields = fields
+        self.tail = tail
+
+        # First seat row, a middle one and the last one (borders differ)
+        seat_rows = rows[HEADER_ROWS:]
+        marks = {cell: f"{_MARK}{i}{_MARK}" for i, cell in enumerate(SEAT_CELLS)}
+        self.seat_rows = [_pieces(_fill_row(m.group(), marks))
+                          for m in (seat_rows[0], seat_rows[min(1, len(seat_rows) - 1)], seat_rows[-1])]
+
+    @staticmethod
+    def _join(pieces, values):
+        literal, order = pieces
+        out = [literal[0]]
+        for i, piece in zip(order, literal[1:]):
+            out.append(values[i])
+            out.append(piece)
+        return "".join(out)
+
+    def sheet(self, header, seats):
+        # header: {field: text}; seats: [(seat, arabic, english), ...] one
+        # per seat, blank strings for empty seats
+        values = [escape(str(header.get(name, ""))) for name in self.fields]
+        out = [self._join(self.header, values)]
+        last = len(seats) - 1
+        for i, seat in enumerate(seats):
+            pieces = self.seat_rows[0 if i == 0 else 2 if i == last else 1]
+            out.append(self._join(pieces, [escape(str(v)) for v in seat]))
+        out.append(self.tail)
+        return "".join(out)
+
+    def write(self, path, sheets):
+        # sheets: [(header, seats), ...]
+        body = PAGE_BREAK.join(self.sheet(header, seats) for header, seats in sheets)
+        document = self.before + body + self.spacer + self.after
+        tmp = path + ".tmp"
+        with zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as z:
+            for info, data in self.members:
+                if info.filename == "word/document.xml":
+                    data = document.encode("utf-8")
+                z.writestr(info.filename, data, zipfile.ZIP_DEFLATED)
+        os.replace(tmp, path)
+
+
+def _encode_qr(code):
+    # Dark modules as a list of rows of booleans; same error correction (M)
+    # as admission-card.js
+    try:
+        import qrcode
+    except ImportError:
+        qrcode = None
+    if qrcode is not None:
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=0)
+        qr.add_data(code)
+        qr.make(fit=True)
+        return qr.get_matrix()
+    from reportlab.graphics.barcode.qr import QrCodeWidget
+
+    qr = QrCodeWidget(code, barLevel="M", barBorder=0).qr
+    qr.make()
+    return [[bool(v) for v in row] for row in qr.modules]
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_image(code):
+    # 1-bit image with one pixel per module, kept as a PNG of a few hundred
+    # bytes under CACHE_DIR/qr and scaled up to the card's QR size
+    from PIL import Image
+
+    path = os.path.join(CACHE_DIR, "qr", hashlib.sha1(code.encode("utf-8")).hexdigest() + ".png")
+    try:
+        with Image.open(path) as cached:
+            cached.load()
+            return cached.copy()
+    except OSError:
+        pass
+    matrix = _encode_qr(code)
+    image = Image.new("1", (len(matrix), len(matrix)), 1)
+    image.putdata([0 if dark else 1 for row in matrix for dark in row])
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path + f".{os.getpid()}", format="PNG")
+        os.replace(path + f".{os.getpid()}", path)
+    except OSError:
+        pass
+    return image
+
+
+@lru_cache(maxsize=1)
+def _card_fonts():
+    # (regular, bold, shapes Arabic) font names for the cards
+    path = os.environ.get(FONT_ENV)
+    if not path and os.name == "nt":
+        path = os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts", "arial.ttf")
+    if path and os.path.exists(path):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        pdfmetrics.registerFont(TTFont("CardFont", path))
+        bold = path.replace(".ttf", "bd.ttf")
+        if os.path.exists(bold):
+            pdfmetrics.registerFont(TTFont("CardFont-Bold", bold))
+            return "CardFont", "CardFont-Bold", True
+        return "CardFont", "CardFont", True
+    return "Helvetica", "Helvetica-Bold", False
+
+
+def _visual(text, shape):
+    # Arabic letters joined and laid out right to left, when the shaping
+    # packages are installed
+    if not shape or not re.search("[\u0600-\u06ff]", text):
+        return text
+    try:
+        import arabic_reshaper
+        from bidi.algorithm import get_display
+    except ImportError:
+        return text
+    return get_display(arabic_reshaper.reshape(text))
+
+
+def write_cards(path, cards, assessment=""):
+    # cards: [{"name", "national_id", "session", "time", "center", "lab",
+    # "seat", "code"}, ...]
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.lib.utils import ImageReader
+    from reportlab.pdfgen import canvas
+
+    regular, bold, shape = _card_fonts()
+    page_w, page_h = A4
+    card_w, card_h = 92 * mm, 64 * mm
+    gap_x = (page_w - 2 * card_w) / 3
+    gap_y = (page_h - 4 * card_h) / 5
+    qr_size = 30 * mm
+    tmp = path + ".tmp"
+    pdf = canvas.Canvas(tmp, pagesize=A4, pageCompression=1)
+    pdf.setTitle("Admission Cards")
+
+    def text(x, y, value, font, size, align="left", width=None):
+        value = _visual(value, shape)
+        if width is not None:
+            # Long values are shrunk to fit beside the QR code
+            size = max(4, min(size, size * width / max(pdf.stringWidth(value, font, size), 1)))
+        pdf.setFont(font, size)
+        if align == "center":
+            pdf.drawCentredString(x, y, value)
+        else:
+            pdf.drawString(x, y, value)
+
+    for n, card in enumerate(cards):
+        slot = n % 8
+        if n and not slot:
+            pdf.showPage()
+        x = gap_x + (slot % 2) * (card_w + gap_x)
+        y = page_h - (slot // 2 + 1) * (card_h + gap_y)
+        pdf.setLineWidth(0.8)
+        pdf.roundRect(x, y, card_w, card_h, 3 * mm)
+
+        top = y + card_h
+        text(x + card_w / 2, top - 7 * mm, "ADMISSION CARD", bold, 11, "center")
+        text(x + card_w / 2, top - 11.5 * mm, card["center"], regular, 8, "center")
+        if assessment:
+            text(x + card_w / 2, top - 15.5 * mm, assessment, bold, 8, "center")
+        pdf.line(x + 4 * mm, top - 18 * mm, x + card_w - 4 * mm, top - 18 * mm)
+
+        rows = [("Name:", card["name"]), ("National ID:", card["national_id"]),
+                ("Session:", card["session"]), ("Time:", card["time"]), ("Center:", card["center"]),
+                ("Lab / Seat:", f"{card['lab']} / {card['seat']}")]
+        line = top - 23 * mm
+        width = card_w - qr_size - 26 * mm
+        for label, value in rows:
+            if value:
+                text(x + 4 * mm, line, label, regular, 7)
+                text(x + 20 * mm, line, str(value), bold if label == "Name:" else regular, 7, width=width)
+                line -= 4.5 * mm
+
+        if card["code"]:
+            qx, qy = x + card_w - qr_size - 4 * mm, top - 20 * mm - qr_size
+            pdf.drawImage(ImageReader(qr_image(card["code"])), qx, qy, qr_size, qr_size)
+            text(qx + qr_size / 2, qy - 3.5 * mm, "Scan for attendance", regular, 6, "center")
+
+        text(x + card_w / 2, y + 3 * mm,
+             "Please arrive 15 minutes before the exam. Present this card at the entrance.", regular, 5.5, "center")
+    pdf.save()
+    os.replace(tmp, path)
+
+
+def _safe_name(name):
+    return re.sub(r'[\\/:*?"<>|]+', "_", str(name)).strip() or "center"
+
+
+def _text(value):
+    return (cell_text(value) or "").strip()
+
+
+def _column(df, col, start, stop):
+    if col is None:
+        return [""] * (stop - start)
+    return [_text(v) for v in df[col].iloc[start:stop].tolist()]
+
+
+def document_tasks(df, labs, plan, round_times, arabic_col=None, english_col=None, id_col=None,
+                   code_col=None, codes=None, dates=None):
+    # Splits a distribution into (sheets by day, cards by day and center)
+    # tasks holding only the text that goes on the page
+    rounds = plan["rounds"]
+    matrix = capacity_matrix(labs, rounds)
+    total = len(df)
+    with_cards = code_col is not None or codes is not None
+    sheets, cards = {}, {}
+    for d, r, start, stop in round_slices(plan, total):
+        arabic = _column(df, arabic_col, start, stop)
+        english = _column(df, english_col, start, stop)
+        national = _column(df, id_col, start, stop)
+        if code_col is not None:
+            code = _column(df, code_col, start, stop)
+        elif codes is not None:
+            code = [c or "" for c in codes[start:stop]]
+        begin, end = round_times[r - 1] if r - 1 < len(round_times) else ("", "")
+        times = f"{begin} - {end}" if begin or end else ""
+        session = f"Day {d} – Round {r}"
+        for a, b in value_runs(plan["lab"][start:stop], stop - start):
+            lab = int(plan["lab"][start + a])
+            center, lab_name = labs[lab][0], labs[lab][1]
+            seated = {int(plan["seat"][start + i]): i for i in range(a, b)}
+            seats = [(s, arabic[seated[s]], english[seated[s]]) if s in seated else (s, "", "")
+                     for s in range(1, max(int(matrix[r - 1, lab]), max(seated)) + 1)]
+            header = {"lab": lab_name, "round": f"{r} – {times}" if times else r, "center": center,
+                      "day": f"Day {d}", "date": dates[d - 1] if dates and d - 1 < len(dates) else ""}
+            sheets.setdefault(d, []).append((header, seats))
+            if with_cards:
+                for i in range(a, b):
+                    cards.setdefault((d, center), []).append({
+                        "name": english[i] or arabic[i],
+                        "national_id": national[i], "session": session, "time": times, "center": center,
+                        "lab": lab_name, "seat": int(plan["seat"][start + i]), "code": code[i]})
+    return sheets, cards
+
+
+_worker_template = None
+
+
+def _init_worker(template):
+    global _worker_template
+    _worker_template = template
+
+
+def _document_worker(task):
+    kind, path, items, assessment = task
+    if kind == "sheets":
+        _worker_template.write(path, items)
+        count = sum(1 for header, seats in items)
+    else:
+        write_cards(path, items, assessment)
+        count = len(items)
+    return path, kind, count, peak_rss_mb()
+
+
+def generate_documents(df, labs, plan, round_times, base="Exam_Distribution", arabic_col=None, english_col=None,
+                       id_col=None, code_col=None, codes=None, assessment="", dates=None, template=TEMPLATE_FILE,
+                       workers=1, progress=None, metrics=NULL_METRICS):
+    # Admission cards are only made when attendance codes are given, either
+    # as a sheet column (code_col) or one per row (codes, e.g. from
+    # supabase_loader.fetch_attendance_codes)
+    if df is None:
+        raise ValueError("Attendance sheets and admission cards need the whole roster; turn off streaming.")
+    missing = [c for c in (arabic_col, english_col, id_col, code_col) if c is not None and c not in df.columns]
+    if missing:
+        raise ValueError(f"Unknown column(s) for the sheets and cards: {', '.join(map(str, missing))}")
+    with metrics.stage("documents.load_template"):
+        parsed = AttendanceTemplate(template)
+    with metrics.stage("documents.prepare"):
+        sheets, cards = document_tasks(df, labs, plan, round_times, arabic_col, english_col, id_col,
+                                       code_col, codes, dates)
+    sheet_folder = os.path.join(base, SHEETS_FOLDER)
+    card_folder = os.path.join(base, CARDS_FOLDER)
+    os.makedirs(sheet_folder, exist_ok=True)
+    tasks = [("sheets", os.path.join(sheet_folder, f"Attendance_Day_{d}.docx"), items, assessment)
+             for d, items in sorted(sheets.items())]
+    if cards:
+        os.makedirs(card_folder, exist_ok=True)
+        tasks += [("cards", os.path.join(card_folder, f"Cards_Day_{d}_{_safe_name(center)}.pdf"), items, assessment)
+                  for (d, center), items in sorted(cards.items(), key=lambda item: (item[0][0], str(item[0][1])))]
+    # Progress counts sheets and cards together
+    def weight(task):
+        return len(task[2])
+
+    total = sum(weight(task) for task in tasks)
+
+    written, counts, peaks = [], {"sheets": 0, "cards": 0}, []
+    done = 0
+
+    def finished(task, result):
+        nonlocal done
+        path, kind, count, peak = result
+        written.append(path)
+        counts[kind] += count
+        if peak is not None:
+            peaks.append(peak)
+        done += weight(task)
+        if progress:
+            progress(done, total)
+
+    if workers > 1 and len(tasks) > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(parsed,))
+        try:
+            # Biggest files first, so one large center doesn't finish last
+            futures = {pool.submit(_document_worker, task): task for task in sorted(tasks, key=weight, reverse=True)}
+            for future in as_completed(futures):
+                finished(futures[future], future.result())
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        pool.shutdown()
+    else:
+        _init_worker(parsed)
+        for task in tasks:
+            with metrics.stage(f"documents.write_{task[0]}"):
+                finished(task, _document_worker(task))
+
+    if metrics.enabled:
+        metrics.count("sheets_written", counts["sheets"])
+        metrics.count("cards_written", counts["cards"])
+        metrics.count("files_written", len(written))
+    return {"files": sorted(written), "sheets": counts["sheets"], "cards": counts["cards"],
+            "peak_rss_mb": max(peaks) if peaks else peak_rss_mb()}
@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+
+
+# Runs a long job on a worker thread while the Tk window stays responsive.
+#
+# The job function receives a JobContext. It calls ctx.progress(done, total)
+# between batches (which raises Cancelled once Cancel was pressed; an
+# optional stage or detail string is passed through to the UI) and
+# ctx.log(msg) for log lines. Everything the UI needs goes through a
+# queue.Queue that the Tk thread drains with root.after(), so no widget is
+# ever touched from the worker thread.
+
+
+class Cancelled(Exception):
+    pass
+
+
+def format_rate(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    text = f"{done:,}" + (f" / {total:,}" if total else "") + f" rows  •  {rate:,.0f} rows/s"
+    if total and rate > 0 and done < total:
+        eta = (total - done) / rate
+        text += f"  •  ETA {int(eta // 60)}:{int(eta % 60):02d}"
+    return text
+
+
+class JobContext:
+    def __init__(self, events, cancel_event):
+        self._events = events
+        self._cancel = cancel_event
+        self.started = time.perf_counter()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def progress(self, done, total=None, stage=None, detail=None):
+        self._events.put(("progress", (done, total, stage, time.perf_counter() - self.started, detail)))
+        self.check()
+
+    def log(self, msg):
+        self._events.put(("log", msg))
+
+
+class BackgroundJob:
+    def __init__(self, root, work, on_done=None, on_error=None, on_progress=None,
+                 on_log=None, on_cancel=None, poll_ms=100):
+        self.root = root
+        self.work = work
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.on_log = on_log
+        self.on_cancel = on_cancel
+        self.poll_ms = poll_ms
+        self._events = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.root.after(self.poll_ms, self._poll)
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        ctx = JobContext(self._events, self._cancel)
+        try:
+            self._events.put(("done", self.work(ctx)))
+        except Cancelled:
+            self._events.put(("cancelled", None))
+        except Exception as e:
+            self._events.put(("error", e))
+
+    def _poll(self):
+        latest = None
+        while True:
+            try:
+                kind, payload = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                # Only the newest progress value is worth drawing
+                latest = payload
+            elif kind == "log":
+                if self.on_log:
+                    self.on_log(payload)
+            else:
+                if latest is not None and self.on_progress:
+                    self.on_progress(*latest)
+                if kind == "done" and self.on_done:
+                    self.on_done(payload)
+                elif kind == "error" and self.on_error:
+                    self.on_error(payload)
+                elif kind == "cancelled" and self.on_cancel:
+                    self.on_cancel()
+                return
+        if latest is not None and self.on_progress:
+            self.on_progress(*latest)
+        self.root.after(self.poll_ms, self._poll)
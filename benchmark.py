@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+
+# Benchmarks for the distributor and the mail merge on synthetic rosters.
+#
+#   python -m benchmark                                  # 1k, 10k and 100k rows
+#   python -m benchmark --sizes 1000,1000000 --work-dir bench_data
+#   python -m benchmark --sizes 1000,10000 --baseline    # exit 1 on a regression
+#
+# For every size a roster workbook (Arabic and English names, e-mails,
+# schools), a centers/labs config and a folder of dummy attachments are
+# generated; with --work-dir they are kept and reused by later runs.
+#
+#   distribution  load (Excel parse) -> load_cached (sidecar) -> analyze -> export
+#   mail          match (attachment index) -> render (templates) -> send
+#
+# "send" goes through SendScheduler and the SMTP transport's connection
+# pool with a connection that only serializes the message, so it measures
+# everything but the network. The mail_smtp case (--cases mail_smtp, needs
+# aiosmtpd) sends to a local aiosmtpd server instead, so the SMTP
+# conversation itself is timed as well. Each case runs in its own process, so the
+# peak memory reported is that case's alone.
+#
+# benchmark_baseline.json is the reference run at 1k and 10k rows that
+# --baseline compares against by default. Timings depend on the machine,
+# so regenerate it on the machine that runs the comparison, and again
+# after a change that is meant to move the numbers:
+#
+#   python -m benchmark --sizes 1000,10000 --save-baseline benchmark_baseline.json
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+MAIL_MAX_ROWS = 100000
+RESULTS_FILE = "benchmark_results.json"
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+ARABIC_FIRST = ["محمد", "أحمد", "علي", "عمر", "خالد", "يوسف", "إبراهيم", "حسن", "سارة", "فاطمة",
+                "مريم", "نور", "ليلى", "هدى", "آمنة", "ريم"]
+ENGLISH_FIRST = ["Mohammed", "Ahmed", "Ali", "Omar", "Khalid", "Yousef", "Ibrahim", "Hassan", "Sara",
+                 "Fatima", "Maryam", "Noor", "Layla", "Huda", "Amna", "Reem"]
+ARABIC_LAST = ["الحربي", "العتيبي", "القحطاني", "الشمري", "الزهراني", "المطيري", "الدوسري", "الغامدي"]
+ENGLISH_LAST = ["Alharbi", "Alotaibi", "Alqahtani", "Alshammari", "Alzahrani", "Almutairi", "Aldosari",
+                "Alghamdi"]
+SUBJECTS = ["Arabic", "English", "Mathematics", "Science", "Social Studies", "Islamic Studies"]
+DOMAINS = ["moe.gov.example", "school.example", "mail.example", "example.com"]
+
+
+def synthetic_roster(rows, seed=0):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    first = rng.integers(0, len(ARABIC_FIRST), rows)
+    last = rng.integers(0, len(ARABIC_LAST), rows)
+    ids = np.char.add("EX", np.char.zfill(np.arange(1, rows + 1).astype(str), 7))
+    english = np.char.add(np.char.add(np.array(ENGLISH_FIRST)[first], " "), np.array(ENGLISH_LAST)[last])
+    email = np.char.add(np.char.add(np.char.lower(np.char.replace(english, " ", ".")), "."),
+                        np.char.add(np.char.add(np.arange(rows).astype(str), "@"),
+                                    np.array(DOMAINS)[rng.integers(0, len(DOMAINS), rows)]))
+    return pd.DataFrame({
+        "Examinee ID": ids,
+        "Name (Arabic)": np.char.add(np.char.add(np.array(ARABIC_FIRST)[first], " "), np.array(ARABIC_LAST)[last]),
+        "Name (English)": english,
+        "Email": email,
+        "Gender": np.where(first < 8, "Male", "Female"),
+        "School": np.char.add("School ", rng.integers(1, max(2, rows // 200), rows).astype(str)),
+        "Subject": np.array(SUBJECTS)[rng.integers(0, len(SUBJECTS), rows)],
+    })
+
+
+def synthetic_config(rows, seed=0):
+    # Roughly one center per 5,000 examinees, 4-12 labs of 20-40 seats,
+    # 3 rounds a day: a few days of exams at any size
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    labs = []
+    for c in range(max(1, rows // 5000)):
+        for l in range(int(rng.integers(4, 13))):
+            labs.append((f"Center {c + 1}", f"Lab {l + 1}", int(rng.integers(20, 41)),
+                         f"https://maps.example/?q=center{c + 1}"))
+    round_times = [("08:00", "10:00"), ("11:00", "13:00"), ("14:00", "16:00")]
+    return labs, round_times
+
+
+def write_roster(df, path):
+    from distribution_export import StreamingWorkbook
+
+    book = StreamingWorkbook(path)
+    book.write_sheet("Examinees", df)
+    book.close()
+
+
+def write_attachments(folder, ids, size=2048):
+    os.makedirs(folder, exist_ok=True)
+    body = b"%PDF-1.4\n" + b"0" * max(0, size - 16) + b"\n%%EOF\n"
+    for key in ids:
+        with open(os.path.join(folder, f"{key}_admission.pdf"), "wb") as f:
+            f.write(body)
+
+
+def prepare_data(rows, work_dir, seed=0):
+    # Generates (or reuses) the workbook and attachments for one size
+    folder = os.path.join(work_dir, f"roster_{rows}_{seed}")
+    workbook = os.path.join(folder, "examinees.xlsx")
+    attachments = os.path.join(folder, "attachments")
+    df = None
+    if not os.path.exists(workbook):
+        os.makedirs(folder, exist_ok=True)
+        df = synthetic_roster(rows, seed)
+        write_roster(df, workbook + ".tmp")
+        os.replace(workbook + ".tmp", workbook)
+    if rows <= MAIL_MAX_ROWS and not os.path.exists(os.path.join(attachments, ".complete")):
+        if df is None:
+            df = synthetic_roster(rows, seed)
+        write_attachments(attachments, df["Examinee ID"].tolist())
+        open(os.path.join(attachments, ".complete"), "w").close()
+    return workbook, attachments
+
+
+class NullConnection:
+    # Stands in for smtplib.SMTP: serializes the message and drops it
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def send_message(self, msg):
+        self.bytes_sent += len(msg.as_bytes())
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        self.bytes_sent += len(msg)
+
+    def quit(self):
+        pass
+
+
+def fake_transport(connections=4):
+    from mail_transport import SmtpTransport
+
+    class FakeTransport(SmtpTransport):
+        def _connect(self):
+            conn = NullConnection()
+            with self._lock:
+                self._open.append(conn)
+            return conn
+
+    return FakeTransport("localhost", sender="bench@example.com", security="none", connections=connections)
+
+
+class _Discard:
+    async def handle_DATA(self, server, session, envelope):
+        return "250 OK"
+
+
+def local_smtp_server():
+    # A started aiosmtpd server on a free localhost port that drops every message
+    import socket
+    from aiosmtpd.controller import Controller
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    controller = Controller(_Discard(), hostname="127.0.0.1", port=port)
+    controller.start()
+    return controller
+
+
+def _stage(stages, name, rows, fn):
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    stages[name] = {"seconds": round(seconds, 4),
+                    "rows_per_second": round(rows / seconds, 1) if seconds > 0 else None}
+    return result
+
+
+def bench_distribution(rows, workbook, out_dir, workers=1):
+    import openpyxl  # imported up front so its import isn't timed as parsing
+    import excel_input
+    from distribution_engine import analyze
+    from distribution_export import export_distribution
+
+    labs, round_times = synthetic_config(rows)
+    # A private sidecar cache, so the first load is a real Excel parse
+    excel_input.CACHE_DIR = os.path.join(out_dir, "cache")
+    stages = {}
+    df = _stage(stages, "load", rows, lambda: excel_input.load_sheet(workbook))
+    excel_input._frames.clear()
+    df = _stage(stages, "load_cached", rows, lambda: excel_input.load_sheet(workbook))
+    analyzed = _stage(stages, "analyze", rows, lambda: analyze(df, labs, len(round_times)))
+    _stage(stages, "export", rows, lambda: export_distribution(
+        df, labs, analyzed["plan"], round_times, os.path.join(out_dir, "Exam_Distribution"), "xlsx", workers))
+    return stages
+
+
+def bench_mail(rows, workbook, attachments, out_dir, smtp=False):
+    import excel_input
+    from mail_attachments import AttachmentIndex
+    from mail_template import MessageTemplate
+    from mail_scheduler import SendScheduler
+
+    # A private sidecar cache, so the user's own cache is never touched
+    excel_input.CACHE_DIR = os.path.join(out_dir, "cache")
+    df = excel_input.load_sheet(workbook)
+    stages = {}
+
+    def match():
+        keys = [str(v).strip() for v in df["Examinee ID"].tolist()]
+        index = AttachmentIndex(attachments, "substring").prepare(keys)
+        return [index.path(found[0]) if len(found) == 1 else None for found in map(index.lookup, keys)]
+
+    template = MessageTemplate("Admission card - {{Examinee ID}}",
+                               "Dear {{Name (English)}},\nPlease find your admission card attached.",
+                               "عزيزي {{Name (Arabic)}}،\nتجدون بطاقة الدخول مرفقة.", df.columns)
+    paths = _stage(stages, "match", rows, match)
+    rendered = _stage(stages, "render", rows, lambda: list(template.render_rows(df)))
+
+    def send(transport):
+        scheduler = SendScheduler(transport)
+        scheduler.open()
+        for to_email, (subject, html), path in zip(df["Email"].tolist(), rendered, paths):
+            scheduler.submit(to_email, subject, html, path)
+        scheduler.close()
+        return scheduler.stats
+
+    if smtp:
+        from mail_transport import SmtpTransport
+
+        server = local_smtp_server()
+        try:
+            transport = SmtpTransport(server.hostname, server.port, sender="bench@example.com", security="none")
+            sent = _stage(stages, "send", rows, lambda: send(transport))
+        finally:
+            server.stop()
+    else:
+        sent = _stage(stages, "send", rows, lambda: send(fake_transport()))
+    if sent["sent"] != rows:
+        raise RuntimeError(f"Sent {sent['sent']} of {rows} messages")
+    return stages
+
+
+def run_case(case, rows, work_dir, seed=0, workers=1):
+    from run_metrics import peak_rss_mb
+
+    workbook, attachments = prepare_data(rows, work_dir, seed)
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as out_dir:
+        if case == "distribution":
+            stages = bench_distribution(rows, workbook, out_dir, workers)
+        else:
+            stages = bench_mail(rows, workbook, attachments, out_dir, smtp=case == "mail_smtp")
+    wall = time.perf_counter() - started
+    return {"case": case, "rows": rows, "wall_seconds": round(wall, 4),
+            "rows_per_second": round(rows / wall, 1), "peak_rss_mb": peak_rss_mb(), "stages": stages}
+
+
+def _isolated(case, rows, work_dir, seed, workers):
+    # Fresh process per case, so peak memory isn't inherited from the last one
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_case, case, rows, work_dir, seed, workers).result()
+
+
+def compare(results, baseline, threshold=0.2, floor=0.1):
+    # Stages that got more than `threshold` slower (and at least `floor`
+    # seconds slower, to ignore noise on tiny runs) than the baseline
+    before = {(r["case"], r["rows"], name): stage["seconds"]
+              for r in baseline["results"] for name, stage in r["stages"].items()}
+    regressions = []
+    for r in results["results"]:
+        for name, stage in r["stages"].items():
+            old = before.get((r["case"], r["rows"], name))
+            if old is None:
+                continue
+            now = stage["seconds"]
+            if now > old * (1 + threshold) and now - old > floor:
+                regressions.append({"case": r["case"], "rows": r["rows"], "stage": name,
+                                    "baseline_seconds": old, "seconds": now, "change": round(now / old - 1, 3)})
+    return regressions
+
+
+def format_results(results):
+    lines = [f"{'case':<14}{'rows':>10}  {'stage':<12}{'seconds':>10}{'rows/s':>14}"]
+    for r in results["results"]:
+        for name, stage in r["stages"].items():
+            rate = f"{stage['rows_per_second']:,.0f}" if stage["rows_per_second"] else "-"
+            lines.append(f"{r['case']:<14}{r['rows']:>10,}  {name:<12}{stage['seconds']:>10.3f}{rate:>14}")
+        peak = f"{r['peak_rss_mb']:.0f} MB" if r["peak_rss_mb"] is not None else "n/a"
+        lines.append(f"{r['case']:<14}{r['rows']:>10,}  {'total':<12}{r['wall_seconds']:>10.3f}"
+                     f"{r['rows_per_second']:>14,.0f}   peak {peak}")
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark the distributor and the mail merge.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated roster sizes (default: %(default)s)")
+    parser.add_argument("--cases", default="distribution,mail", help="comma-separated: distribution, mail, mail_smtp (default: %(default)s)")
+    parser.add_argument("--work-dir", default=None, help="keep generated rosters here and reuse them")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="export processes for the distribution case")
+    parser.add_argument("--output", default=RESULTS_FILE, help="results JSON (default: %(default)s)")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE_FILE, default=None,
+                        help="results JSON to compare against (default: benchmark_baseline.json)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before failing (default: 20%%)")
+    parser.add_argument("--save-baseline", metavar="PATH", default=None, help="also write the results here")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    for case in cases:
+        if case not in ("distribution", "mail", "mail_smtp"):
+            raise SystemExit(f"Unknown case: {case}")
+
+    temp = None
+    work_dir = args.work_dir
+    if work_dir is None:
+        temp = tempfile.TemporaryDirectory()
+        work_dir = temp.name
+    results = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "platform": platform.platform(), "cpus": os.cpu_count(), "results": []}
+    try:
+        for rows in sizes:
+            for case in cases:
+                if case.startswith("mail") and rows > MAIL_MAX_ROWS:
+                    print(f"Skipping mail at {rows:,} rows (over {MAIL_MAX_ROWS:,} attachments)")
+                    continue
+                print(f"Running {case} at {rows:,} rows...", flush=True)
+                results["results"].append(_isolated(case, rows, work_dir, args.seed, args.workers))
+    finally:
+        if temp is not None:
+            temp.cleanup()
+
+    print(format_results(results))
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        compared = {(r["case"], r["rows"]) for r in baseline["results"]}
+        if not any((r["case"], r["rows"]) in compared for r in results["results"]):
+            print(f"Nothing to compare: {args.baseline} has no results at these sizes")
+            return 1
+        regressions = compare(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['case']} {r['rows']:,} rows {r['stage']}: "
+                  f"{r['baseline_seconds']:.3f}s -> {r['seconds']:.3f}s ({r['change']:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import sys
+
+
+# Headless entry point for the exam distributor:
+#
+#   python -m distribute_cli examinees.xlsx --config centers.json
+#
+# The config file (JSON, or YAML when PyYAML is installed) describes the
+# same things the GUI asks for:
+#
+#   {
+#     "rounds": [{"from": "08:00", "to": "10:00"}, {"from": "11:00", "to": "13:00"}],
+#     "centers": [
+#       {"name": "Center A", "link": "https://maps...",
+#        "labs": [{"name": "Lab 1", "capacity": 30}, {"name": "Lab 2", "capacity": [25, 20]}]}
+#     ]
+#   }
+#
+# A capacity given as a list is one value per round.
+#
+# pandas, numpy and the export modules are imported only once the
+# arguments are parsed, so --help returns immediately.
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="distribute_cli",
+        description="Distribute examinees across centers, labs, rounds and days.")
+    parser.add_argument("workbook", help="examinees Excel file")
+    parser.add_argument("--config", required=True, help="centers/labs/rounds config (JSON or YAML)")
+    parser.add_argument("--sheet", default=None, help="sheet name (default: first sheet)")
+    parser.add_argument("--rounds", type=int, default=None,
+                        help="rounds per day (default: number of rounds in the config)")
+    parser.add_argument("--strategy", default="sequential", choices=("sequential", "balanced", "optimized"),
+                        help="how seats are filled (default: sequential)")
+    parser.add_argument("--group-by", default=None,
+                        help="comma-separated columns whose examinees are kept together (e.g. School,Gender)")
+    parser.add_argument("--time-budget", type=float, default=5.0,
+                        help="seconds the optimized strategy may spend (default: 5)")
+    parser.add_argument("--output", default="Exam_Distribution", help="output folder")
+    parser.add_argument("--format", default="xlsx", choices=("xlsx", "csv", "parquet"),
+                        help="output file format")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to write day files")
+    parser.add_argument("--report-only", action="store_true", help="print the report without writing files")
+    parser.add_argument("--no-files", action="store_true", help="skip writing the Exam_Distribution files")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep the assignment saved in the output folder and only rewrite changed days "
+                             "(needs --id-column; sequential strategy only)")
+    parser.add_argument("--stream", action="store_true",
+                        help="read and export the sheet in chunks instead of loading it whole "
+                             "(sequential strategy only)")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="write stage timings and peak memory (JSON) for this run to DIR")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="also write a cProfile dump (.pstats) of the run; slow "
+                             "(to --profile DIR, or ./run_profiles)")
+    publish = parser.add_argument_group("publishing to Supabase/Postgres")
+    publish.add_argument("--publish", metavar="DSN", default=None,
+                         help="database connection string, or 'env' to use $DATABASE_URL")
+    publish.add_argument("--assessment-id", default=None, help="assessments.id to link examinees to")
+    publish.add_argument("--prune-withdrawn", action="store_true",
+                         help="delete examinees of this assessment, in the centers being published, who are "
+                              "no longer in the sheet (their attendance records go with them)")
+    publish.add_argument("--name-column", default=None, help="sheet column with the examinee's full name")
+    publish.add_argument("--id-column", default=None, help="sheet column with a unique examinee ID (e.g. national ID)")
+    documents = parser.add_argument_group("attendance sheets and admission cards")
+    documents.add_argument("--documents", action="store_true",
+                           help="write attendance sheets (and admission cards when attendance codes are known)")
+    documents.add_argument("--arabic-name-column", default=None, help="sheet column with the Arabic name")
+    documents.add_argument("--english-name-column", default=None, help="sheet column with the English name")
+    documents.add_argument("--code-column", default=None,
+                           help="sheet column with the attendance code; with --publish the codes are read back "
+                                "from the database instead")
+    documents.add_argument("--assessment-name", default="", help="assessment name printed on the cards")
+    documents.add_argument("--dates", default=None, help="comma-separated date of each day, for the sheets")
+    return parser
+
+
+def load_config(path):
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("reading YAML configs needs PyYAML (pip install pyyaml)")
+            try:
+                return yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(str(e))
+        return json.load(f)
+
+
+def config_labs(config):
+    from distribution_engine import parse_capacity
+
+    labs = []
+    for center in config.get("centers", []):
+        for lab in center.get("labs", []):
+            labs.append((center["name"], lab["name"], parse_capacity(lab["capacity"]), center.get("link", "")))
+    return labs
+
+
+def config_round_times(config, rounds):
+    times = [(str(r.get("from", "")), str(r.get("to", ""))) for r in config.get("rounds", [])]
+    if rounds is None:
+        return times
+    return (times + [("", "")] * rounds)[:rounds]
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.publish and not (args.name_column and args.id_column):
+        parser.error("--publish needs --name-column and --id-column")
+    if args.prune_withdrawn and not (args.publish and args.assessment_id):
+        parser.error("--prune-withdrawn needs --publish and --assessment-id")
+    if args.incremental and not args.id_column:
+        parser.error("--incremental needs --id-column")
+    if args.incremental and (args.group_by or args.strategy != "sequential"):
+        parser.error("--incremental only works with the sequential strategy, without --group-by")
+    if args.stream and (args.incremental or args.publish or args.documents or args.group_by
+                        or args.strategy != "sequential"):
+        parser.error("--stream only works with the sequential strategy, without --group-by, "
+                     "--incremental, --publish or --documents")
+    if args.rounds is not None and args.rounds <= 0:
+        parser.error("--rounds must be greater than zero")
+    if args.publish == "env" and not os.environ.get("DATABASE_URL"):
+        parser.error("--publish env needs $DATABASE_URL to be set")
+    try:
+        config = load_config(args.config)
+        labs = config_labs(config)
+        round_times = config_round_times(config, args.rounds)
+    except OSError as e:
+        parser.error(f"can't read {args.config}: {e.strerror}")
+    except KeyError as e:
+        parser.error(f"invalid config {args.config}: missing {e}")
+    except (ValueError, TypeError, AttributeError) as e:
+        # JSON/YAML syntax, a capacity that isn't a number, a list where a
+        # mapping belongs, ...
+        parser.error(f"invalid config {args.config}: {e}")
+    if not round_times:
+        parser.error("no rounds: list them under 'rounds' in the config or give --rounds")
+    if not labs:
+        parser.error("the config has no labs")
+    from distribution_engine import capacity_matrix
+
+    try:
+        seats = capacity_matrix(labs, len(round_times)).sum()
+    except ValueError as e:
+        parser.error(f"invalid config {args.config}: {e}")
+    if seats <= 0:
+        parser.error("the labs in the config have no seats")
+
+    from run_metrics import run_metrics
+
+    metrics = run_metrics("distribute_cli", args.profile, args.cprofile or None).start()
+    try:
+        return distribute(args, labs, round_times, metrics)
+    except (ValueError, OSError) as e:
+        # Bad input found while running (no capacity, missing or duplicate
+        # IDs, unreadable workbook): a message, not a traceback
+        sys.exit(f"distribute_cli: error: {e}")
+    finally:
+        summary = metrics.finish()
+        if summary:
+            print(f"Run summary: {summary['summary']}")
+
+
+def distribute(args, labs, round_times, metrics):
+    if args.stream:
+        return distribute_stream(args, labs, round_times, metrics)
+
+    from distribution_engine import analyze
+    from excel_input import load_sheet
+
+    with metrics.stage("analyze.read_workbook"):
+        df = load_sheet(args.workbook, args.sheet if args.sheet is not None else 0)
+    metrics.count("rows", len(df))
+    named = [args.id_column, args.name_column, args.arabic_name_column, args.english_name_column,
+             args.code_column] + [c.strip() for c in (args.group_by or "").split(",")]
+    missing = [c for c in named if c and c not in df.columns]
+    if missing:
+        raise ValueError(f"not a column of the sheet: {', '.join(missing)}")
+    with metrics.stage("analyze.assign_seats"):
+        if args.incremental:
+            from distribution_state import load_state, incremental_plan
+
+            df, plan, stats = incremental_plan(df, labs, len(round_times), args.id_column, load_state(args.output))
+            analyzed = analyze(df, labs, len(round_times), plan)
+        elif args.strategy != "sequential" or args.group_by:
+            from distribution_scheduler import schedule
+
+            group_by = [c.strip() for c in (args.group_by or "").split(",") if c.strip()]
+            df, plan = schedule(df, labs, len(round_times), args.strategy, group_by, args.time_budget)
+            analyzed = analyze(df, labs, len(round_times), plan)
+        else:
+            analyzed = analyze(df, labs, len(round_times))
+    print(analyzed["report"])
+    if args.incremental:
+        print(f"Kept in place: {stats['kept']}  Moved: {stats['moved']}  "
+              f"New: {stats['new']}  Withdrawn: {stats['withdrawn']}")
+    if args.report_only:
+        return 0
+
+    if not args.no_files:
+        if args.incremental:
+            from distribution_state import export_changed
+
+            result = export_changed(df, labs, analyzed["plan"], round_times, args.id_column,
+                                    args.output, args.format, args.workers, metrics=metrics)
+        else:
+            from distribution_export import export_distribution
+
+            result = export_distribution(df, labs, analyzed["plan"], round_times,
+                                         args.output, args.format, args.workers, metrics=metrics)
+        print(f"Files exported to: {os.path.abspath(args.output)} ({len(result['files'])} files)")
+        if args.incremental:
+            print(f"Days rewritten: {', '.join(map(str, result['days_written'])) or 'none'}")
+        if result["peak_rss_mb"] is not None:
+            print(f"Peak memory: {result['peak_rss_mb']:.0f} MB")
+
+    if args.publish:
+        from supabase_loader import publish_distribution
+
+        dsn = os.environ["DATABASE_URL"] if args.publish == "env" else args.publish
+        with metrics.stage("publish"):
+            published = publish_distribution(
+                df, labs, analyzed["plan"], dsn, args.name_column, args.id_column, args.assessment_id,
+                prune_withdrawn=args.prune_withdrawn,
+                on_prune=lambda count: print(f"Removing {count} withdrawn examinee(s) before committing"))
+        print(f"Published {published['rows']} examinees ({published['centers_created']} new centers) "
+              f"in {published['seconds']:.1f}s — {published['rows_per_second']:,.0f} rows/s")
+
+    if args.documents:
+        from attendance_documents import generate_documents
+
+        codes = None
+        if args.publish and not args.code_column:
+            from supabase_loader import fetch_attendance_codes
+
+            with metrics.stage("documents.fetch_codes"):
+                codes = fetch_attendance_codes(df, dsn, args.id_column, args.assessment_id)
+        dates = [d.strip() for d in args.dates.split(",")] if args.dates else None
+        made = generate_documents(df, labs, analyzed["plan"], round_times, args.output, args.arabic_name_column,
+                                  args.english_name_column or args.name_column, args.id_column,
+                                  args.code_column, codes, args.assessment_name, dates, workers=args.workers,
+                                  metrics=metrics)
+        print(f"Attendance sheets: {made['sheets']}  Admission cards: {made['cards']} ({len(made['files'])} files)")
+        if not made["cards"] and codes is None and not args.code_column:
+            print("No admission cards: give --code-column, or --publish to use the database's attendance codes")
+    return 0
+
+
+def distribute_stream(args, labs, round_times, metrics):
+    # Counts the rows, plans the seats from the count alone and then exports
+    # chunk by chunk, so the whole sheet is never held in memory
+    from distribution_engine import analyze, capacity_matrix, stream_plan
+    from excel_input import count_rows, iter_chunks
+
+    sheet = args.sheet if args.sheet is not None else 0
+    rounds = len(round_times)
+    with metrics.stage("analyze.count_rows"):
+        total = count_rows(args.workbook, sheet)
+    metrics.count("rows", total)
+    with metrics.stage("analyze.assign_seats"):
+        analyzed = analyze(None, labs, rounds, stream_plan(total, capacity_matrix(labs, rounds), rounds))
+    print(analyzed["report"])
+    if args.report_only or args.no_files:
+        return 0
+
+    from distribution_export import export_stream
+
+    result = export_stream(iter_chunks(args.workbook, sheet), labs, analyzed["plan"], round_times,
+                           args.output, args.format, metrics=metrics)
+    print(f"Files exported to: {os.path.abspath(args.output)} ({len(result['files'])} files)")
+    if result["peak_rss_mb"] is not None:
+        print(f"Peak memory: {result['peak_rss_mb']:.0f} MB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
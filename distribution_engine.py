@@ -0,0 +1,230 @@
+import math
+import numpy as np
+from excel_input import cell_text
+
+
+# Seat assignment for the exam distributor, kept free of any GUI code.
+#
+# Seats are filled in the same order the distributor has always used:
+# every lab of every center (in the order they were entered) is filled to
+# capacity for round 1, then round 2, ... then the next day. Instead of
+# walking seat by seat, each examinee's position is mapped straight to
+# its day / round / lab using the cumulative lab capacities.
+#
+# A lab's capacity may be a single number or one number per round (e.g. a
+# lab that loses seats in the afternoon round).
+
+ASSIGNMENT_COLUMNS = ["Center", "Lab", "Day Number", "Time", "Round Number", "Center Link"]
+
+
+def capacity_matrix(labs, rounds):
+    # (rounds, labs) seats per lab per round; a per-round list shorter than
+    # the number of rounds repeats its last value
+    matrix = np.zeros((rounds, len(labs)), dtype=np.int64)
+    for i, lab in enumerate(labs):
+        capacity = lab[2]
+        if isinstance(capacity, (list, tuple)):
+            if not capacity:
+                raise ValueError(f"Lab '{lab[1]}' has no capacity.")
+            capacity = (list(capacity) + [capacity[-1]] * rounds)[:rounds]
+        matrix[:, i] = capacity
+    if (matrix < 0).any():
+        raise ValueError("Lab capacity can't be negative.")
+    return matrix
+
+
+def parse_capacity(value):
+    # 30, "30", or per round: [30, 25] / "30/25"
+    if isinstance(value, (list, tuple)):
+        return tuple(int(v) for v in value) if len(value) > 1 else int(value[0])
+    parts = [p.strip() for p in str(value).split("/")]
+    if len(parts) > 1:
+        return tuple(int(p) for p in parts)
+    return int(parts[0])
+
+
+def _as_matrix(capacities, rounds):
+    capacities = np.asarray(capacities, dtype=np.int64)
+    if capacities.ndim == 1:
+        return np.tile(capacities, (max(rounds, 0), 1))
+    return capacities
+
+
+def plan_seats(total, capacities, rounds, start=0):
+    # capacities: one per lab, or a (rounds, labs) matrix. With start, only
+    # rows start..total-1 are planned (a chunk of a streamed sheet).
+    matrix = _as_matrix(capacities, rounds)
+    daily_capacity = int(matrix.sum())
+    if rounds <= 0 or daily_capacity <= 0:
+        raise ValueError("Rounds per day and total lab capacity must be greater than zero.")
+
+    labs = matrix.shape[1]
+    days = math.ceil(total / daily_capacity)
+    day, within = np.divmod(np.arange(start, total, dtype=np.int64), daily_capacity)
+    # cells of one day in fill order: round 1 lab 1, round 1 lab 2, ...
+    cells = matrix.ravel()
+    ends = np.cumsum(cells)
+    cell = np.searchsorted(ends, within, side="right")
+    # 1-based seat within the lab for that round, in row order
+    seat_number = within - (ends - cells)[cell] + 1
+    round_index, lab_index = np.divmod(cell, labs)
+
+    return {
+        "day": day + 1,
+        "round": round_index + 1,
+        "lab": lab_index,
+        "seat": seat_number,
+        "rounds": rounds,
+        "capacity_per_round": matrix.sum(axis=1).tolist(),
+        "days": days,
+        "summary": summarize(day * rounds + round_index, days, rounds),
+    }
+
+
+def stream_plan(total, capacities, rounds):
+    # Sequential plan without the per-row arrays, for streamed sheets: the
+    # rows are seated chunk by chunk at export time
+    matrix = _as_matrix(capacities, rounds)
+    daily_capacity = int(matrix.sum())
+    if rounds <= 0 or daily_capacity <= 0:
+        raise ValueError("Rounds per day and total lab capacity must be greater than zero.")
+    days = math.ceil(total / daily_capacity)
+    slot_capacity = np.tile(matrix.sum(axis=1), days)
+    before = np.cumsum(slot_capacity) - slot_capacity
+    counts = np.clip(total - before, 0, slot_capacity).reshape(days, rounds)
+    return {
+        "rounds": rounds,
+        "capacity_per_round": matrix.sum(axis=1).tolist(),
+        "days": days,
+        "summary": {d + 1: counts[d].tolist() for d in range(days)},
+        "total": total,
+    }
+
+
+def summarize(slot, days, rounds):
+    # slot = (day - 1) * rounds + (round - 1) per examinee
+    counts = np.bincount(slot, minlength=days * rounds).reshape(days, rounds)
+    return {d + 1: counts[d].tolist() for d in range(days)}
+
+
+def analyze(df, labs, rounds, plan=None):
+    # plan defaults to a fresh sequential fill; pass one in to report on an
+    # existing assignment (e.g. an incremental run). df is None for a
+    # streamed sheet, with a plan from stream_plan.
+    total = len(df) if df is not None else plan["total"]
+    if plan is None:
+        plan = plan_seats(total, capacity_matrix(labs, rounds), rounds)
+    capacity_per_round = plan["capacity_per_round"]
+    daily_capacity = sum(capacity_per_round)
+    days_needed = plan["days"]
+    summary = plan["summary"]
+
+    report = []
+    report.append("Exam Distribution Summary")
+    report.append("=========================")
+    report.append(f"Total Examinees       : {total}")
+    report.append(f"Number of Labs        : {len(labs)}")
+    report.append(f"Rounds per Day        : {rounds}")
+    if len(set(capacity_per_round)) == 1:
+        report.append(f"Capacity Per Round    : {capacity_per_round[0]}")
+    else:
+        report.append(f"Capacity Per Round    : {' / '.join(map(str, capacity_per_round))}")
+    report.append(f"Total Daily Capacity  : {daily_capacity}")
+    report.append(f"Recommended Days      : {days_needed}\n")
+
+    round_headers = [f"Round {i+1}" for i in range(rounds)]
+    report.append("Distribution Table (Per Day & Round):")
+    report.append("-" * (5 + 12 * rounds))
+    report.append("Day".ljust(8) + ''.join(r.ljust(12) for r in round_headers))
+    report.append("-" * (5 + 12 * rounds))
+
+    for day, counts in summary.items():
+        report.append(str(day).ljust(8) + ''.join(str(c).ljust(12) for c in counts))
+
+    if plan.get("metrics"):
+        report.append("")
+        report.append(f"Schedule Quality ({plan.get('strategy', 'sequential')}):")
+        for label, value in plan["metrics"].items():
+            report.append(f"  {label.ljust(28)}: {value}")
+
+    report.append("\n© 2025 Firas Kiftaro. All rights reserved.\n")
+    return {
+        "df": df,
+        "labs": labs,
+        "rounds": rounds,
+        "days": days_needed,
+        "summary": summary,
+        "plan": plan,
+        "report": "\n".join(report)
+    }
+
+
+def examinee_keys(df, id_col):
+    # Stable per-examinee keys from an ID column; must be present and unique
+    keys = [(cell_text(v) or "").strip() or None for v in df[id_col].tolist()]
+    missing = [i + 2 for i, key in enumerate(keys) if key is None]
+    if missing:
+        raise ValueError(f"{len(missing)} row(s) have no value in '{id_col}' (first: row {missing[0]})")
+    seen = set()
+    duplicates = {key for key in keys if key in seen or seen.add(key)}
+    if duplicates:
+        raise ValueError(f"'{id_col}' must be unique; duplicated: {', '.join(sorted(duplicates)[:10])}")
+    return keys
+
+
+def assignment_columns(labs, plan, round_times, start, stop):
+    lab_index = plan["lab"][start:stop]
+    round_number = plan["round"][start:stop]
+    times = np.array([f"{begin} - {end}" for begin, end in round_times], dtype=object)
+    return {
+        "Center": np.array([lab[0] for lab in labs], dtype=object)[lab_index],
+        "Lab": np.array([lab[1] for lab in labs], dtype=object)[lab_index],
+        "Day Number": plan["day"][start:stop],
+        "Time": times[round_number - 1],
+        "Round Number": round_number,
+        "Center Link": np.array([lab[3] for lab in labs], dtype=object)[lab_index],
+    }
+
+
+def assign_seats(df, labs, rounds, round_times):
+    # labs: [(center name, lab name, capacity, center link), ...]
+    # round_times: [(from, to), ...] one pair per round
+    plan = plan_seats(len(df), capacity_matrix(labs, rounds), rounds)
+    assigned = df.assign(**assignment_columns(labs, plan, round_times, 0, len(df)))
+    return assigned, plan
+
+
+def iter_assigned_rounds(df, labs, plan, round_times):
+    # Same rows as assign_seats, but only one round is materialized at a time.
+    for d, r, start, stop in round_slices(plan, len(df)):
+        columns = assignment_columns(labs, plan, round_times, start, stop)
+        yield d, r, df.iloc[start:stop].assign(**columns)
+
+
+def value_runs(values, total):
+    # (start, stop) of each run of equal values in an array sorted by them
+    values = np.asarray(values[:total])
+    if total == 0:
+        return []
+    edges = (np.flatnonzero(np.diff(values)) + 1).tolist()
+    return list(zip([0] + edges, edges + [total]))
+
+
+def round_slices(plan, total):
+    # Yields (day, round, start, stop) row ranges; rows are ordered by day
+    # and round, so the rows of one round are contiguous.
+    slot = (plan["day"][:total] - 1) * plan["rounds"] + plan["round"][:total] - 1
+    for start, stop in value_runs(slot, total):
+        yield int(plan["day"][start]), int(plan["round"][start]), start, stop
+
+
+def day_slices(plan, total):
+    for start, stop in value_runs(plan["day"], total):
+        yield int(plan["day"][start]), start, stop
+
+
+def slice_plan(plan, start, stop):
+    part = {key: value for key, value in plan.items() if key != "summary"}
+    for key in ("day", "round", "lab", "seat"):
+        part[key] = plan[key][start:stop]
+    return part
@@ -0,0 +1,268 @@
+import os
+from distribution_engine import (iter_assigned_rounds, day_slices, round_slices, slice_plan, plan_seats,
+                                 capacity_matrix, assignment_columns)
+from excel_input import cell_text
+from run_metrics import NULL_METRICS, peak_rss_mb
+
+
+# Writers for the Exam_Distribution output. Rows are streamed into each
+# Round_{r} sheet in batches through an openpyxl write-only workbook, so
+# only the round being written is ever held in memory.
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+BATCH_ROWS = 5000
+
+
+def _cell_rows(frame):
+    for start in range(0, len(frame), BATCH_ROWS):
+        batch = frame.iloc[start:start + BATCH_ROWS].astype(object)
+        yield from batch.where(batch.notna(), None).to_numpy().tolist()
+
+
+class StreamingWorkbook:
+    def __init__(self, path):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        self.path = path
+        self._cell = WriteOnlyCell
+        self._bold = Font(bold=True)
+        self.book = Workbook(write_only=True)
+
+    def write_sheet(self, name, frame):
+        sheet = self.book.create_sheet(title=name)
+        header = []
+        for col in frame.columns:
+            cell = self._cell(sheet, value=str(col))
+            cell.font = self._bold
+            header.append(cell)
+        sheet.append(header)
+        for row in _cell_rows(frame):
+            sheet.append(row)
+
+    def close(self):
+        self.book.save(self.path)
+
+
+def _arrow_safe(frame):
+    # Arrow can't type an object column that mixes numbers and text (common
+    # for Excel ID columns), so such columns are written as text
+    import pandas as pd
+
+    mixed = [col for col in frame.columns[(frame.dtypes == object).to_numpy()]
+             if pd.api.types.infer_dtype(frame[col], skipna=True) in ("mixed", "mixed-integer")]
+    if not mixed:
+        return frame
+    frame = frame.copy()
+    for col in mixed:
+        frame[col] = frame[col].map(cell_text)
+    return frame
+
+
+def _write_flat(frame, path, fmt):
+    if fmt == "csv":
+        for start in range(0, len(frame), BATCH_ROWS):
+            frame.iloc[start:start + BATCH_ROWS].to_csv(
+                path, index=False, header=start == 0,
+                mode="w" if start == 0 else "a",
+                encoding="utf-8-sig" if start == 0 else "utf-8")
+    else:
+        _arrow_safe(frame).to_parquet(path, index=False)
+
+
+def _write_day(day_df, labs, day_plan, round_times, base, fmt, d, on_round=None, metrics=NULL_METRICS):
+    written = []
+    book = None
+    if fmt == "xlsx":
+        book = StreamingWorkbook(os.path.join(base, f"Day_{d}.xlsx"))
+        written.append(book.path)
+    rounds = iter_assigned_rounds(day_df, labs, day_plan, round_times)
+    for _, r, frame in metrics.iterate("export.assign_columns", rounds):
+        with metrics.stage("export.write_rows"):
+            if book is not None:
+                book.write_sheet(f"Round_{r}", frame)
+            else:
+                path = os.path.join(base, f"Day_{d}_Round_{r}.{fmt}")
+                _write_flat(frame, path, fmt)
+                written.append(path)
+        if on_round:
+            on_round(len(frame))
+    if book is not None:
+        with metrics.stage("export.save_workbook"):
+            book.close()
+    return written
+
+
+def _share_roster(df, folder):
+    # Workers memory-map one Arrow file instead of each receiving a pickled
+    # copy of their rows. Falls back to pickling when pyarrow is missing or
+    # the sheet has columns Arrow can't type (e.g. mixed numbers and text).
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except Exception:
+        return None
+    path = os.path.join(folder, "roster.arrow")
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def _export_day_worker(task):
+    d, rows, start, stop, labs, day_plan, round_times, base, fmt = task
+    if isinstance(rows, str):
+        import pyarrow as pa
+        with pa.memory_map(rows) as source:
+            rows = pa.ipc.open_file(source).read_all().slice(start, stop - start).to_pandas()
+    return _write_day(rows, labs, day_plan, round_times, base, fmt, d), peak_rss_mb()
+
+
+def _export_parallel(df, labs, plan, round_times, base, fmt, workers, progress, selected):
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with tempfile.TemporaryDirectory() as folder:
+        shared = _share_roster(df, folder)
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = {}
+            for d, start, stop in selected:
+                rows = shared if shared else df.iloc[start:stop]
+                task = (d, rows, start, stop, labs, slice_plan(plan, start, stop), round_times, base, fmt)
+                futures[pool.submit(_export_day_worker, task)] = (d, stop - start)
+
+            results = {}
+            total = sum(stop - start for _, start, stop in selected)
+            done = 0
+            for future in as_completed(futures):
+                d, count = futures[future]
+                results[d] = future.result()
+                done += count
+                if progress:
+                    progress(done, total)
+        except BaseException:
+            # Cancelled or failed: drop the days that haven't started yet
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+    ordered = [results[d] for d in sorted(results)]
+    written = [path for paths, _ in ordered for path in paths]
+    peaks = [peak for _, peak in ordered if peak is not None]
+    return written, max(peaks) if peaks else None
+
+
+def export_distribution(df, labs, plan, round_times, base="Exam_Distribution", fmt="xlsx", workers=1,
+                        progress=None, days=None, metrics=NULL_METRICS):
+    # workers > 1 writes the days in parallel processes; each day file is
+    # produced by the same _write_day call either way, so the content matches.
+    # progress(rows_done, total_rows) is called after every round (serial)
+    # or every finished day (parallel); it may raise to stop the export.
+    # days, when given, limits the export to those day numbers. With
+    # parallel workers only the whole export is timed, not its stages.
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(base, exist_ok=True)
+
+    selected = [(d, start, stop) for d, start, stop in day_slices(plan, len(df))
+                if days is None or d in days]
+    total = sum(stop - start for _, start, stop in selected)
+
+    worker_peak = None
+    if workers > 1 and len(selected) > 1:
+        with metrics.stage("export.parallel_days"):
+            written, worker_peak = _export_parallel(df, labs, plan, round_times, base, fmt, workers, progress,
+                                                    selected)
+    else:
+        written = []
+        done = [0]
+
+        def on_round(count):
+            done[0] += count
+            if progress:
+                progress(done[0], total)
+
+        for d, start, stop in selected:
+            day_plan = slice_plan(plan, start, stop)
+            written += _write_day(df.iloc[start:stop], labs, day_plan, round_times, base, fmt, d, on_round,
+                                  metrics)
+
+    if metrics.enabled:
+        metrics.count("rows_written", total)
+        metrics.count("files_written", len(written))
+        metrics.count("bytes_written", sum(os.path.getsize(path) for path in written))
+
+    peak = peak_rss_mb()
+    if worker_peak is not None and peak is not None:
+        peak = max(peak, worker_peak)
+    return {"files": written, "rows": total, "peak_rss_mb": peak}
+
+
+def export_stream(chunks, labs, plan, round_times, base="Exam_Distribution", fmt="xlsx", progress=None,
+                  metrics=NULL_METRICS):
+    # Sequential export of a streamed sheet: chunks are DataFrames in sheet
+    # order (excel_input.iter_chunks) and plan comes from stream_plan. Seats
+    # are worked out per chunk, and only the round being filled is held in
+    # memory until it is written, so memory depends on the round size, not
+    # on the sheet size.
+    import pandas as pd
+
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(base, exist_ok=True)
+    matrix = capacity_matrix(labs, plan["rounds"])
+    total = plan["total"]
+    written = []
+    state = {"key": None, "pending": [], "book": None, "day": None}
+
+    def flush():
+        if not state["pending"]:
+            return
+        d, r = state["key"]
+        frame = pd.concat(state["pending"], ignore_index=True)
+        state["pending"] = []
+        with metrics.stage("export.write_rows"):
+            if fmt == "xlsx":
+                if state["day"] != d:
+                    close_book()
+                    state["book"] = StreamingWorkbook(os.path.join(base, f"Day_{d}.xlsx"))
+                    state["day"] = d
+                    written.append(state["book"].path)
+                state["book"].write_sheet(f"Round_{r}", frame)
+            else:
+                path = os.path.join(base, f"Day_{d}_Round_{r}.{fmt}")
+                _write_flat(frame, path, fmt)
+                written.append(path)
+
+    def close_book():
+        if state["book"] is not None:
+            with metrics.stage("export.save_workbook"):
+                state["book"].close()
+            state["book"] = None
+
+    done = 0
+    for chunk in metrics.iterate("export.read_chunk", chunks):
+        with metrics.stage("export.assign_columns"):
+            part = plan_seats(done + len(chunk), matrix, plan["rounds"], start=done)
+            pieces = []
+            for d, r, start, stop in round_slices(part, len(chunk)):
+                columns = assignment_columns(labs, part, round_times, start, stop)
+                pieces.append(((d, r), chunk.iloc[start:stop].assign(**columns)))
+        for key, piece in pieces:
+            if key != state["key"]:
+                flush()
+                state["key"] = key
+            state["pending"].append(piece)
+        done += len(chunk)
+        if progress:
+            progress(done, max(total, done))
+    flush()
+    close_book()
+
+    if metrics.enabled:
+        metrics.count("rows_written", done)
+        metrics.count("files_written", len(written))
+        metrics.count("bytes_written", sum(os.path.getsize(path) for path in written))
+    return {"files": written, "rows": done, "peak_rss_mb": peak_rss_mb()}
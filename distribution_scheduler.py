@@ -0,0 +1,277 @@
+import math
+import time
+import numpy as np
+from distribution_engine import plan_seats, capacity_matrix, summarize
+
+
+# Scheduling strategies for the distributor. Each one returns the rows
+# reordered by day / round / lab / seat together with a plan in the same
+# shape plan_seats produces, so the report and the exporters work on any
+# of them.
+#
+#   sequential  fill every lab to capacity, round by round, day by day (the
+#               distributor's original order)
+#   balanced    same number of days, but every round of every day, and
+#               every lab within a round, gets the same share of its
+#               capacity, so the last day is not left half empty and the
+#               centers carry an even load
+#   optimized   balanced targets, then whole "keep together" groups
+#               (e.g. school, gender, subject) are packed into rounds and
+#               labs, letting a round run up to `tolerance` over its
+#               balanced share; several packings are tried within the time
+#               budget and the cheapest one is kept
+#
+# Capacity bookkeeping is done on arrays of cells, one cell per lab per
+# round per day (cell = slot * labs + lab, slot = (day - 1) * rounds +
+# round - 1); Python only loops over groups, never over seats.
+
+STRATEGIES = ("sequential", "balanced", "optimized")
+
+# Attempts for the optimized strategy: (share of the tolerance a round may
+# exceed its balanced target by, best fit instead of worst fit, labs filled
+# in order instead of packed)
+PACKINGS = [(0.0, False, True), (0.0, True, True), (0.0, True, False), (0.5, True, True),
+            (0.5, True, False), (1.0, True, True), (1.0, False, True), (1.0, True, False)]
+
+
+def _group_codes(df, group_by):
+    missing = [c for c in group_by if c not in df.columns]
+    if missing:
+        raise ValueError(f"Unknown column(s) to keep together: {', '.join(map(str, missing))}")
+    return df.groupby(list(group_by), sort=True, dropna=False).ngroup().to_numpy(np.int64)
+
+
+def _spread(total, capacities):
+    # Splits total over the capacities in proportion (largest remainder);
+    # never exceeds a capacity as long as total <= capacities.sum()
+    capacities = np.asarray(capacities, dtype=np.int64)
+    available = capacities.sum()
+    if total == 0 or available == 0:
+        return np.zeros(len(capacities), dtype=np.int64)
+    share = total * capacities / available
+    counts = np.floor(share).astype(np.int64)
+    rest = int(total - counts.sum())
+    if rest:
+        counts[np.argsort(counts - share, kind="stable")[:rest]] += 1
+    return counts
+
+
+def _plan_from_cells(cell, total, matrix, rounds, strategy):
+    # cell per row (in the current row order) -> (row order, plan)
+    labs = matrix.shape[1]
+    order = np.argsort(cell, kind="stable")
+    cell = cell[order]
+    starts = np.searchsorted(cell, cell, side="left")
+    seat = np.arange(total, dtype=np.int64) - starts + 1
+    slot, lab = np.divmod(cell, labs)
+    days = int(slot.max()) // rounds + 1 if total else 0
+    plan = {
+        "day": slot // rounds + 1,
+        "round": slot % rounds + 1,
+        "lab": lab,
+        "seat": seat,
+        "rounds": rounds,
+        "capacity_per_round": matrix.sum(axis=1).tolist(),
+        "days": days,
+        "summary": summarize(slot, days, rounds),
+        "strategy": strategy,
+    }
+    return order, plan
+
+
+def _balanced_cells(total, matrix, days):
+    counts = _spread(total, np.tile(matrix.ravel(), days))
+    return np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+
+
+def _pack(sizes, limits, best_fit, deadline):
+    # Places items of the given sizes into bins with the given limits,
+    # splitting an item only when no bin has room for all of it; the pieces
+    # then go to neighbouring bins (the next rounds of the day, the next labs
+    # of the center). Returns (item, bin, count) arrays, or None once the
+    # deadline has passed.
+    room = np.asarray(limits, dtype=np.int64).copy()
+    items, bins, counts = [], [], []
+    for n, item in enumerate(np.argsort(-sizes, kind="stable")):
+        if deadline is not None and n % 256 == 255 and time.monotonic() > deadline:
+            return None
+        left = int(sizes[item])
+        while left:
+            fits = np.flatnonzero(room >= left)
+            if len(fits):
+                b = fits[np.argmin(room[fits])] if best_fit else int(np.argmax(room))
+                take = left
+            else:
+                b = int(np.flatnonzero(room)[0])
+                take = int(room[b])
+            room[b] -= take
+            left -= take
+            items.append(item)
+            bins.append(b)
+            counts.append(take)
+    return (np.array(items, dtype=np.int64), np.array(bins, dtype=np.int64),
+            np.array(counts, dtype=np.int64))
+
+
+def _fill_in_order(counts, lab_target):
+    # Lays the pieces end to end over the labs' targets, so a piece is only
+    # split where one lab ends and the next (usually same center) begins.
+    # Returns (piece, lab, count) arrays.
+    piece_ends = np.cumsum(counts)
+    lab_ends = np.cumsum(lab_target)
+    cuts = np.union1d(piece_ends, lab_ends[lab_target > 0])
+    starts = np.concatenate(([0], cuts[:-1]))
+    piece = np.searchsorted(piece_ends, starts, side="right")
+    lab = np.searchsorted(lab_ends, starts, side="right")
+    return piece, lab, cuts - starts
+
+
+def _splits(group, values, width):
+    # Extra pieces beyond one per group when grouping by `values`
+    pairs = np.unique(group * width + values)
+    return len(pairs) - len(np.unique(group))
+
+
+def _packed_cells(groups, matrix, days, slack, best_fit, lab_order, center_of_lab, deadline):
+    # groups: group code per row, rows sorted by it. Returns (cell per row,
+    # cost) or None when out of time.
+    rounds, labs = matrix.shape
+    slot_capacity = np.tile(matrix.sum(axis=1), days)
+    sizes = np.bincount(groups)
+    target = _spread(len(groups), slot_capacity)
+    limits = np.minimum(slot_capacity, np.ceil(target * (1 + slack)).astype(np.int64))
+    packed = _pack(sizes, limits, best_fit, deadline)
+    if packed is None:
+        return None
+    item, slot, count = packed
+    load = np.bincount(slot, weights=count, minlength=len(slot_capacity)).astype(np.int64)
+
+    # Within each round, share that round's group pieces out over its labs
+    pieces_group, pieces_cell, pieces_count = [], [], []
+    by_slot = np.lexsort((item, slot))
+    bounds = np.searchsorted(slot[by_slot], np.arange(len(slot_capacity) + 1))
+    for s in range(len(slot_capacity)):
+        chosen = by_slot[bounds[s]:bounds[s + 1]]
+        if not len(chosen):
+            continue
+        capacity = matrix[s % rounds]
+        lab_target = _spread(int(load[s]), capacity)
+        if lab_order:
+            inner = _fill_in_order(count[chosen], lab_target)
+        else:
+            lab_limits = np.minimum(capacity, np.ceil(lab_target * (1 + slack)).astype(np.int64))
+            inner = _pack(count[chosen], lab_limits, best_fit, deadline)
+            if inner is None:
+                return None
+        piece, lab, taken = inner
+        pieces_group.append(item[chosen][piece])
+        pieces_cell.append(s * labs + lab)
+        pieces_count.append(taken)
+
+    group = np.concatenate(pieces_group)
+    cell = np.concatenate(pieces_cell)
+    taken = np.concatenate(pieces_count)
+    # Rows are sorted by group, so the pieces in group order line up with them
+    order = np.argsort(group, kind="stable")
+    row_cell = np.repeat(cell[order], taken[order])
+
+    # Splitting a group across rounds costs 1, across centers 1/2, across
+    # labs 1/4, and moving an average group's worth of examinees off the
+    # balanced target costs 1
+    piece_slot, piece_lab = np.divmod(cell, labs)
+    moved = np.abs(load - target).sum() / 2
+    cost = (_splits(group, piece_slot, len(slot_capacity))
+            + _splits(group, piece_slot * labs + center_of_lab[piece_lab], len(slot_capacity) * labs) / 2
+            + _splits(group, cell, len(slot_capacity) * labs) / 4
+            + moved * np.count_nonzero(sizes) / len(groups))
+    return row_cell, cost
+
+
+def _center_codes(labs):
+    centers = {}
+    return np.array([centers.setdefault(lab[0], len(centers)) for lab in labs], dtype=np.int64)
+
+
+def schedule(df, labs, rounds, strategy="sequential", group_by=None, time_budget=5.0, tolerance=0.05):
+    # Returns (rows, plan); plan["metrics"] holds the quality figures shown
+    # in the report
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown scheduling strategy: {strategy}")
+    started = time.monotonic()
+    matrix = capacity_matrix(labs, rounds)
+    total = len(df)
+    groups = _group_codes(df, group_by) if group_by else None
+
+    # Rows of a group are kept next to each other, in sheet order
+    order = np.argsort(groups, kind="stable") if groups is not None else np.arange(total)
+    rows = df.iloc[order]
+    grouped = groups[order] if groups is not None else None
+
+    if strategy == "sequential":
+        plan = plan_seats(total, matrix, rounds)
+        plan["strategy"] = strategy
+        cells_order = np.arange(total)
+    else:
+        days = math.ceil(total / matrix.sum()) if matrix.sum() > 0 and rounds > 0 else 0
+        if days == 0 and total:
+            raise ValueError("Rounds per day and total lab capacity must be greater than zero.")
+        cell = None
+        if strategy == "optimized" and grouped is not None and total:
+            deadline = started + time_budget
+            center_of_lab = _center_codes(labs)
+            best = None
+            for share, best_fit, lab_order in PACKINGS:
+                # The first attempt always runs to the end
+                attempt = _packed_cells(grouped, matrix, days, share * tolerance, best_fit, lab_order,
+                                        center_of_lab, deadline if best is not None else None)
+                if attempt is None:
+                    break
+                if best is None or attempt[1] < best[1]:
+                    best = attempt
+                if best[1] == 0 or time.monotonic() > deadline:
+                    break
+            cell = best[0]
+        if cell is None:
+            cell = _balanced_cells(total, matrix, days)
+        cells_order, plan = _plan_from_cells(cell, total, matrix, rounds, strategy)
+
+    rows = rows.iloc[cells_order].reset_index(drop=True)
+    if grouped is not None:
+        grouped = grouped[cells_order]
+    plan["metrics"] = schedule_metrics(plan, labs, matrix, grouped)
+    plan["metrics"]["Scheduling time"] = f"{time.monotonic() - started:.2f}s"
+    return rows, plan
+
+
+def schedule_metrics(plan, labs, matrix, groups=None):
+    rounds, lab_count = matrix.shape
+    days = plan["days"]
+    metrics = {}
+    if not days:
+        return metrics
+    slot = (plan["day"] - 1) * rounds + plan["round"] - 1
+    slot_load = np.bincount(slot, minlength=days * rounds)
+    day_load = slot_load.reshape(days, rounds).sum(axis=1)
+    metrics["Last day load"] = f"{day_load[-1]} ({day_load[-1] / day_load.mean():.0%} of the average day)"
+    metrics["Examinees per round"] = f"{slot_load.min()} - {slot_load.max()}"
+
+    # Seats used / seats offered per center over all days
+    center_of_lab = _center_codes(labs)
+    centers = int(center_of_lab.max()) + 1 if len(labs) else 0
+    used = np.bincount(center_of_lab[plan["lab"]], minlength=centers)
+    offered = np.bincount(center_of_lab, weights=matrix.sum(axis=0), minlength=centers) * days
+    utilization = used / np.maximum(offered, 1)
+    metrics["Center utilization"] = f"{utilization.min():.0%} - {utilization.max():.0%}"
+
+    if groups is not None and len(groups):
+        count = int(groups.max()) + 1
+        metrics["Groups"] = count
+
+        def split(values, width):
+            pairs = np.unique(groups * width + values)
+            return int(np.count_nonzero(np.bincount(pairs // width, minlength=count) > 1))
+
+        metrics["Groups split across rounds"] = split(slot, days * rounds)
+        metrics["Groups split across centers"] = split(center_of_lab[plan["lab"]], centers)
+        metrics["Groups split across labs"] = split(slot * lab_count + plan["lab"], days * rounds * lab_count)
+    return metrics
@@ -0,0 +1,233 @@
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from distribution_engine import (plan_seats, capacity_matrix, summarize, examinee_keys, round_slices,
+                                 day_slices, assignment_columns)
+from distribution_export import export_distribution
+from run_metrics import NULL_METRICS
+
+
+# Keeps the distribution stable between runs.
+#
+# After an export, the assignment of every examinee (keyed on an ID
+# column) is saved next to the Day files, together with a digest of each
+# day's content. The next run starts from that assignment:
+#
+#   - examinees already seated keep their day / round / lab / seat, as long
+#     as the lab still exists and the seat is still within its capacity and
+#     the configured rounds
+#   - withdrawn examinees (no longer in the sheet) free their seats
+#   - new examinees, and those whose lab or seat went away, take the free
+#     seats in the usual fill order (labs, then rounds, then days), and
+#     only open new days once every existing seat is taken
+#
+# On export only the days whose content changed are written again; files
+# of days that no longer exist are removed.
+#
+# The state is one JSON file (plain data, so it is safe to read from a
+# shared folder), replaced atomically. A state file that exists but can't
+# be used is an error rather than a fresh start, since a fresh start would
+# reseat everyone.
+
+STATE_FILE = "assignment_state.json"
+STATE_COLUMNS = ("key", "day", "round", "center", "lab", "seat")
+
+
+def load_state(base):
+    # None when nothing was saved yet
+    path = os.path.join(base, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if not all(k in state for k in ("id_column", "format", "days")):
+            raise ValueError("incomplete state")
+        state["assignment"] = pd.DataFrame({col: state["assignment"][col] for col in STATE_COLUMNS})
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"The saved assignment in {path} can't be read ({type(e).__name__}: {e}). "
+                         f"Restore it, or delete it to seat everyone afresh.")
+    return state
+
+
+def _free_seats(taken_cells, taken_seats, capacities, cells, needed):
+    # First `needed` free (cell, seat) pairs in fill order among `cells`
+    # existing cells; cell = slot * labs + lab, capacities is (rounds, labs)
+    cell_capacity = np.resize(capacities.ravel(), cells)
+    counts = np.bincount(taken_cells, minlength=cells)[:cells]
+    free = cell_capacity - counts
+    reach = np.cumsum(free)
+    last = int(np.searchsorted(reach, needed)) if needed else -1
+    last = min(last, cells - 1)
+
+    order = np.argsort(taken_cells, kind="stable")
+    sorted_cells = taken_cells[order]
+    sorted_seats = taken_seats[order]
+    out_cells, out_seats = [], []
+    for cell in np.flatnonzero(free[:last + 1] > 0):
+        lo, hi = np.searchsorted(sorted_cells, [cell, cell + 1])
+        seats = np.setdiff1d(np.arange(1, cell_capacity[cell] + 1), sorted_seats[lo:hi])
+        out_cells.append(np.full(len(seats), cell, dtype=np.int64))
+        out_seats.append(seats)
+    if not out_cells:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(out_cells)[:needed], np.concatenate(out_seats)[:needed]
+
+
+def incremental_plan(df, labs, rounds, id_col, state):
+    # Returns (rows, plan, stats); rows is df reordered by day / round / lab
+    # / seat, which is the order the exporter expects.
+    keys = examinee_keys(df, id_col)
+    if rounds <= 0:
+        raise ValueError("Rounds per day and total lab capacity must be greater than zero.")
+    capacities = capacity_matrix(labs, rounds)
+    if capacities.sum() <= 0:
+        raise ValueError("Rounds per day and total lab capacity must be greater than zero.")
+    total = len(df)
+    day = np.zeros(total, dtype=np.int64)
+    rnd = np.zeros(total, dtype=np.int64)
+    lab = np.full(total, -1, dtype=np.int64)
+    seat = np.zeros(total, dtype=np.int64)
+    moved = withdrawn = 0
+
+    if state and state["id_column"] != str(id_col):
+        raise ValueError(f"The saved assignment is keyed on '{state['id_column']}', not '{id_col}'. Choose "
+                         f"'{state['id_column']}', or delete {STATE_FILE} to seat everyone afresh.")
+    previous = state["assignment"] if state else None
+    if previous is not None and len(previous):
+        where = pd.Index(previous["key"]).get_indexer(keys)
+        found = where >= 0
+        withdrawn = len(previous) - int(found.sum())
+        prev = previous.iloc[where[found]]
+        lab_names = pd.MultiIndex.from_tuples([(str(l[0]), str(l[1])) for l in labs])
+        prev_lab = lab_names.get_indexer(pd.MultiIndex.from_arrays([prev["center"], prev["lab"]])).astype(np.int64)
+        prev_seat = prev["seat"].to_numpy(np.int64)
+        prev_round = prev["round"].to_numpy(np.int64)
+        ok = (prev_lab >= 0) & (prev_round <= rounds)
+        ok[ok] &= prev_seat[ok] <= capacities[prev_round[ok] - 1, prev_lab[ok]]
+        # Two examinees can't end up on one seat
+        rows = np.flatnonzero(found)[ok]
+        cells = ((prev["day"].to_numpy(np.int64)[ok] - 1) * rounds + prev_round[ok] - 1) * len(labs) + prev_lab[ok]
+        spot = pd.MultiIndex.from_arrays([cells, prev_seat[ok]])
+        unique = ~spot.duplicated()
+        rows = rows[unique]
+        day[rows] = prev["day"].to_numpy(np.int64)[ok][unique]
+        rnd[rows] = prev_round[ok][unique]
+        lab[rows] = prev_lab[ok][unique]
+        seat[rows] = prev_seat[ok][unique]
+        moved = int(found.sum()) - len(rows)
+
+    kept = lab >= 0
+    waiting = np.flatnonzero(~kept)
+    if len(waiting):
+        taken_cells = ((day[kept] - 1) * rounds + rnd[kept] - 1) * len(labs) + lab[kept]
+        days = int(day.max()) if kept.any() else 0
+        cells, seats = _free_seats(taken_cells, seat[kept], capacities, days * rounds * len(labs),
+                                   len(waiting))
+        placed = waiting[:len(cells)]
+        slot, lab[placed] = np.divmod(cells, len(labs))
+        day[placed] = slot // rounds + 1
+        rnd[placed] = slot % rounds + 1
+        seat[placed] = seats
+
+        overflow = waiting[len(cells):]
+        if len(overflow):
+            extra = plan_seats(len(overflow), capacities, rounds)
+            day[overflow] = extra["day"] + days
+            rnd[overflow] = extra["round"]
+            lab[overflow] = extra["lab"]
+            seat[overflow] = extra["seat"]
+
+    order = np.lexsort((seat, lab, rnd, day))
+    day, rnd, lab, seat = day[order], rnd[order], lab[order], seat[order]
+    days = int(day.max()) if total else 0
+    plan = {
+        "day": day,
+        "round": rnd,
+        "lab": lab,
+        "seat": seat,
+        "rounds": rounds,
+        "capacity_per_round": capacities.sum(axis=1).tolist(),
+        "days": days,
+        "summary": summarize((day - 1) * rounds + rnd - 1, days, rounds),
+    }
+    stats = {"kept": int(kept.sum()), "moved": moved,
+             "new": total - int(kept.sum()) - moved, "withdrawn": withdrawn}
+    return df.iloc[order].reset_index(drop=True), plan, stats
+
+
+def day_digests(df, labs, plan, round_times):
+    # One digest per day over the exported rows and assignment columns
+    if not len(df):
+        return {}
+    rows = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    assigned = pd.DataFrame(assignment_columns(labs, plan, round_times, 0, len(df)))
+    rows = rows * np.uint64(31) + pd.util.hash_pandas_object(assigned, index=False).to_numpy()
+    header = "|".join(map(str, df.columns)).encode("utf-8")
+    return {str(d): hashlib.sha1(header + rows[start:stop].tobytes()).hexdigest()
+            for d, start, stop in day_slices(plan, len(df))}
+
+
+def _day_files(base, fmt, d, rounds=None):
+    if fmt == "xlsx":
+        return [os.path.join(base, f"Day_{d}.xlsx")]
+    if rounds is None:
+        return glob.glob(os.path.join(base, f"Day_{d}_Round_*.{fmt}"))
+    return [os.path.join(base, f"Day_{d}_Round_{r}.{fmt}") for r in rounds]
+
+
+def save_state(base, df, labs, plan, id_col, fmt, digests):
+    centers = [str(lab[0]) for lab in labs]
+    lab_names = [str(lab[1]) for lab in labs]
+    assignment = {
+        "key": examinee_keys(df, id_col),
+        "day": plan["day"].tolist(),
+        "round": plan["round"].tolist(),
+        "center": [centers[i] for i in plan["lab"]],
+        "lab": [lab_names[i] for i in plan["lab"]],
+        "seat": plan["seat"].tolist(),
+    }
+    path = os.path.join(base, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"id_column": str(id_col), "format": fmt, "rounds": plan["rounds"],
+                   "labs": [list(lab) for lab in labs], "days": digests, "assignment": assignment},
+                  f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def export_changed(df, labs, plan, round_times, id_col, base="Exam_Distribution", fmt="xlsx",
+                   workers=1, progress=None, metrics=NULL_METRICS):
+    # df and plan as returned by incremental_plan
+    os.makedirs(base, exist_ok=True)
+    state = load_state(base)
+    old = state["days"] if state and state.get("format") == fmt else {}
+    with metrics.stage("export.digest_days"):
+        digests = day_digests(df, labs, plan, round_times)
+
+    day_rounds = {}
+    for d, r, _, _ in round_slices(plan, len(df)):
+        day_rounds.setdefault(d, []).append(r)
+    changed = {int(d) for d, digest in digests.items()
+               if old.get(d) != digest
+               or not all(os.path.exists(p) for p in _day_files(base, fmt, int(d), day_rounds[int(d)]))}
+
+    removed = []
+    stale_days = set(map(int, state["days"])) if state else set()
+    formats = {fmt, state["format"]} if state else {fmt}
+    for d in sorted((stale_days - set(map(int, digests))) | changed):
+        for path in [p for f in formats for p in _day_files(base, f, d)]:
+            if os.path.exists(path):
+                os.remove(path)
+                removed.append(path)
+
+    result = export_distribution(df, labs, plan, round_times, base, fmt, workers, progress, days=changed,
+                                 metrics=metrics)
+    with metrics.stage("export.save_state"):
+        save_state(base, df, labs, plan, id_col, fmt, digests)
+    result["days_written"] = sorted(changed)
+    result["removed"] = removed
+    return result
@@ -0,0 +1,312 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+
+# Shared workbook loading for the distributor and the mail merge.
+#
+# A parsed sheet is kept in memory for the session and in a columnar
+# sidecar file on disk (Feather when pyarrow is installed, pickle
+# otherwise), keyed on the workbook path, sheet, mtime and size. Reopening
+# an unchanged workbook then skips the Excel parse entirely.
+#
+# iter_chunks() is the streaming alternative for very large sheets: it
+# reads only the requested columns, row by row (python-calamine when
+# installed, otherwise openpyxl in read-only mode), and yields DataFrames
+# of CHUNK_ROWS rows, so memory stays flat whatever the sheet size. A
+# sheet with a Feather sidecar is streamed from it one record batch at a
+# time instead.
+
+CHUNK_ROWS = 10000
+
+CACHE_DIR = os.environ.get("EXAM_TOOLS_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "exam_tools"))
+
+_frames = {}
+
+
+def _file_key(path, sheet):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return path, str(sheet), stat.st_mtime_ns, stat.st_size
+
+
+def _sidecar(key):
+    name = hashlib.sha1(f"{key[0]}|{key[1]}".encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, name)
+
+
+def _read_sidecar(base, key):
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["key"] != list(key):
+            return None
+        if meta["format"] == "feather":
+            return pd.read_feather(base + ".feather")
+        return pd.read_pickle(base + ".pkl")
+    except Exception:
+        return None
+
+
+def _write_sidecar(base, key, df):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        try:
+            df.reset_index(drop=True).to_feather(base + ".feather")
+            fmt = "feather"
+        except Exception:
+            # No pyarrow, or columns Arrow can't type (mixed numbers and text)
+            if os.path.exists(base + ".feather"):
+                os.remove(base + ".feather")
+            df.to_pickle(base + ".pkl")
+            fmt = "pickle"
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump({"key": list(key), "format": fmt}, f)
+    except OSError:
+        pass
+
+
+def sheet_names(path):
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        from openpyxl import load_workbook
+        book = load_workbook(path, read_only=True)
+        try:
+            return book.sheetnames
+        finally:
+            book.close()
+    return pd.ExcelFile(path).sheet_names
+
+
+def read_columns(path, sheet=0):
+    key = _file_key(path, sheet)
+    if key in _frames:
+        return _frames[key].columns.tolist()
+    return pd.read_excel(path, sheet_name=sheet, nrows=0).columns.tolist()
+
+
+def load_sheet(path, sheet=0):
+    key = _file_key(path, sheet)
+    df = _frames.get(key)
+    if df is not None:
+        return df
+
+    base = _sidecar(key)
+    df = _read_sidecar(base, key)
+    if df is None:
+        df = pd.read_excel(path, sheet_name=sheet)
+        _write_sidecar(base, key, df)
+
+    _frames.clear()
+    _frames[key] = df
+    return df
+
+
+def _cached_feather(path, sheet):
+    # The Feather sidecar of an unchanged workbook, or None
+    key = _file_key(path, sheet)
+    base = _sidecar(key)
+    try:
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["key"] == list(key) and meta["format"] == "feather":
+            return base + ".feather"
+    except Exception:
+        pass
+    return None
+
+
+def _feather_chunks(path, columns, chunk_rows):
+    # Re-slices the file's record batches into chunk_rows-row DataFrames,
+    # reading (memory-mapping) one batch at a time rather than the file
+    import pyarrow as pa
+
+    def frame(table, start):
+        df = table.to_pandas()
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        missing = [c for c in columns or () if c not in reader.schema.names]
+        if missing:
+            raise ValueError(f"Column(s) not found in the sheet: {', '.join(map(str, missing))}")
+        pending, rows, start = [], 0, 0
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(columns)
+            pending.append(batch)
+            rows += batch.num_rows
+            while rows >= chunk_rows:
+                table = pa.Table.from_batches(pending)
+                yield frame(table.slice(0, chunk_rows), start)
+                start += chunk_rows
+                rest = table.slice(chunk_rows)
+                pending, rows = rest.to_batches(), rest.num_rows
+        if rows:
+            yield frame(pa.Table.from_batches(pending), start)
+
+
+def _feather_rows(path):
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+def cell_text(value):
+    # A cell as text for templates, keys and the database; None when empty
+    if value is None:
+        return None
+    try:
+        if value != value:  # NaN / NaT
+            return None
+    except TypeError:  # pd.NA
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # IDs read from Excel often come back as 1234.0
+        return str(int(value))
+    return str(value)
+
+
+def _header_names(raw):
+    # Same names pd.read_excel would give: blanks become "Unnamed: i",
+    # repeats get ".1", ".2", ...
+    names, seen = [], {}
+    for i, value in enumerate(raw):
+        name = f"Unnamed: {i}" if value is None or value == "" else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell(value):
+    if value == "":  # calamine reports empty cells as ""
+        return None
+    if isinstance(value, float) and value.is_integer():
+        # as pd.read_excel does: 1234.0 -> 1234
+        return int(value)
+    return value
+
+
+def _sheet_rows(path, sheet):
+    # Raw rows of a sheet as tuples, header first
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        CalamineWorkbook = None
+    if CalamineWorkbook is not None:
+        book = CalamineWorkbook.from_path(path)
+        if isinstance(sheet, int):
+            data = book.get_sheet_by_index(sheet)
+        else:
+            data = book.get_sheet_by_name(sheet)
+        rows = data.iter_rows() if hasattr(data, "iter_rows") else iter(data.to_python(skip_empty_area=False))
+        for row in rows:
+            yield tuple(row)
+        return
+
+    from openpyxl import load_workbook
+    book = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+        yield from ws.iter_rows(values_only=True)
+    finally:
+        book.close()
+
+
+def iter_chunks(path, sheet=0, columns=None, chunk_rows=CHUNK_ROWS):
+    # Yields DataFrames of up to chunk_rows rows in sheet order, holding only
+    # `columns` (all columns when None)
+    cached = _frames.get(_file_key(path, sheet))
+    if cached is not None:
+        if columns is not None:
+            cached = cached[columns]
+        for start in range(0, len(cached), chunk_rows):
+            yield cached.iloc[start:start + chunk_rows]
+        return
+    feather = _cached_feather(path, sheet)
+    if feather is not None:
+        yield from _feather_chunks(feather, columns, chunk_rows)
+        return
+    if not path.lower().endswith((".xlsx", ".xlsm")):
+        # .xls has no row-streaming reader; still only parse the columns needed
+        df = pd.read_excel(path, sheet_name=sheet, usecols=columns)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows]
+        return
+
+    rows = _sheet_rows(path, sheet)
+    header = _header_names(next(rows, None) or ())
+    if columns is None:
+        columns = header
+    missing = [c for c in columns if c not in header]
+    if missing:
+        raise ValueError(f"Column(s) not found in the sheet: {', '.join(map(str, missing))}")
+    picks = [header.index(c) for c in columns]
+    width = max(picks) + 1 if picks else 0
+
+    batch, blank = [], 0
+    for row in rows:
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        values = [_cell(row[i]) for i in picks]
+        if all(v is None for v in values):
+            # Blank rows count only when more data follows (trailing
+            # formatted-but-empty rows are dropped, like pd.read_excel)
+            blank += 1
+            continue
+        if blank:
+            batch.extend([[None] * len(picks)] * blank)
+            blank = 0
+        batch.append(values)
+        if len(batch) >= chunk_rows:
+            yield pd.DataFrame(batch[:chunk_rows], columns=columns)
+            batch = batch[chunk_rows:]
+    if batch:
+        yield pd.DataFrame(batch, columns=columns)
+
+
+def count_rows(path, sheet=0):
+    # Exact number of data rows iter_chunks will yield, without building
+    # any DataFrames
+    cached = _frames.get(_file_key(path, sheet))
+    if cached is not None:
+        return len(cached)
+    feather = _cached_feather(path, sheet)
+    if feather is not None:
+        return _feather_rows(feather)
+    if not path.lower().endswith((".xlsx", ".xlsm")):
+        return len(pd.read_excel(path, sheet_name=sheet, usecols=[0]))
+    rows = _sheet_rows(path, sheet)
+    next(rows, None)
+    total = last = 0
+    for row in rows:
+        total += 1
+        if any(v is not None and v != "" for v in row):
+            last = total
+    return last
+
+
+def estimate_rows(path, sheet=0):
+    # Row count from the sheet's stored dimensions, for progress bars; may
+    # be None or count trailing blank rows
+    key = _file_key(path, sheet)
+    if key in _frames:
+        return len(_frames[key])
+    if not path.lower().endswith((".xlsx", ".xlsm")):
+        return None
+    from openpyxl import load_workbook
+    book = load_workbook(path, read_only=True)
+    try:
+        ws = book.worksheets[sheet] if isinstance(sheet, int) else book[sheet]
+        return max(0, ws.max_row - 1) if ws.max_row else None
+    finally:
+        book.close()
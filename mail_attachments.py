@@ -0,0 +1,205 @@
+import os
+import bisect
+import threading
+import mimetypes
+from concurrent.futures import Future
+from collections import defaultdict, OrderedDict
+from email.message import MIMEPart
+
+
+# Attachment lookup for the mail merge.
+#
+# The attachments folder is scanned once per run with os.scandir and every
+# row's match value is resolved against that index, instead of listing the
+# folder again for each row. Three modes are supported:
+#
+#   substring - the file name contains the value (the original behaviour)
+#   prefix    - the file name starts with the value
+#   exact     - the file name without its extension equals the value
+#
+# Keys that hit more than one file are reported as ambiguous rather than
+# silently sending whichever file the directory listing returned first.
+
+MATCH_MODES = ("substring", "prefix", "exact")
+
+# Encoded attachments kept for reuse across messages (see EncodedAttachments)
+CACHE_BYTES = 64 * 1024 * 1024
+
+
+class AttachmentIndex:
+    def __init__(self, folder, mode="substring"):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode: {mode}")
+        self.folder = folder
+        self.mode = mode
+        with os.scandir(folder) as entries:
+            self.names = sorted(e.name for e in entries if e.is_file())
+        self._by_stem = None
+        self._matches = {}
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _exact(self, key):
+        if self._by_stem is None:
+            self._by_stem = defaultdict(list)
+            for name in self.names:
+                self._by_stem[os.path.splitext(name)[0]].append(name)
+        return self._by_stem.get(key, [])
+
+    def _prefix(self, key):
+        found = []
+        i = bisect.bisect_left(self.names, key)
+        while i < len(self.names) and self.names[i].startswith(key):
+            found.append(self.names[i])
+            i += 1
+        return found
+
+    def _resolve(self, keys):
+        if self.mode == "substring":
+            return _substring_matches(keys, self.names)
+        if self.mode == "prefix":
+            return {k: self._prefix(k) for k in keys}
+        return {k: self._exact(k) for k in keys}
+
+    def prepare(self, keys):
+        # Resolves every key in one pass over the file names; lookup() then
+        # answers from the precomputed table.
+        self._matches.update(self._resolve({k for k in keys if k}))
+        return self
+
+    def lookup(self, key):
+        if not key:
+            return []
+        if key not in self._matches:
+            self._matches.update(self._resolve({key}))
+        return self._matches[key]
+
+    def ambiguous(self):
+        return {k: v for k, v in self._matches.items() if len(v) > 1}
+
+
+def _substring_matches(keys, names):
+    matches = {k: [] for k in keys}
+    if not keys:
+        return matches
+    try:
+        import ahocorasick
+    except ImportError:
+        ahocorasick = None
+
+    if ahocorasick is not None:
+        automaton = ahocorasick.Automaton()
+        for k in keys:
+            automaton.add_word(k, k)
+        automaton.make_automaton()
+        for name in names:
+            for k in {k for _, k in automaton.iter(name)}:
+                matches[k].append(name)
+        return matches
+
+    # Without pyahocorasick: look up every substring of each file name whose
+    # length is one of the key lengths. Match values are usually IDs of one
+    # or two fixed lengths, so this stays linear in the total name length.
+    lengths = sorted({len(k) for k in keys})
+    for name in names:
+        hits = set()
+        for size in lengths:
+            if size > len(name):
+                break
+            for i in range(len(name) - size + 1):
+                part = name[i:i + size]
+                if part in matches:
+                    hits.add(part)
+        for k in hits:
+            matches[k].append(name)
+    return matches
+
+
+def attachment_paths(attachments):
+    # A message's attachments: None, one path, or a list of paths
+    if not attachments:
+        return []
+    if isinstance(attachments, (str, os.PathLike)):
+        return [attachments]
+    return [path for path in attachments if path]
+
+
+class EncodedAttachments:
+    # MIME parts of attachment files, read and base64-encoded once and then
+    # attached as-is to every message that carries the same file (a common
+    # attachment sent to everyone, a schedule shared by a center). Each part
+    # also keeps its body in wire form (CRLF line ends) as encoded_body, so
+    # the SMTP transport writes it in one piece instead of line by line.
+    # Parts are keyed on path, mtime and size, and the least recently used
+    # ones are dropped once the encoded total passes max_bytes; a single
+    # file larger than that is encoded per message and never cached. Shared
+    # by the SMTP sending threads; concurrent requests for a file not yet
+    # cached share one read and encode.
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._parts = OrderedDict()
+        self._size = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.bytes_read = 0
+
+    def part(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            found = self._parts.get(key)
+            if found is not None:
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return found[0]
+            # A file another thread is already encoding is waited for, not
+            # read and encoded a second time
+            waiting = self._pending.get(key)
+            if waiting is None:
+                self._pending[key] = encoding = Future()
+            else:
+                self.hits += 1
+        if waiting is not None:
+            return waiting.result()
+
+        try:
+            part, size, read = _encode(path)
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            encoding.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._pending[key]
+            self.misses += 1
+            self.bytes_read += read
+            if size <= self.max_bytes:
+                self._parts[key] = (part, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    _, (_, dropped) = self._parts.popitem(last=False)
+                    self._size -= dropped
+                    self.evictions += 1
+        encoding.set_result(part)
+        return part
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "bytes_read": self.bytes_read, "cached": len(self._parts), "cached_bytes": self._size}
+
+
+def _encode(path):
+    # (part, encoded size held in memory, bytes read) for one file
+    ctype, _ = mimetypes.guess_type(path)
+    maintype, subtype = (ctype or "application/octet-stream").split("/", 1)
+    with open(path, "rb") as f:
+        data = f.read()
+    part = MIMEPart()
+    part.set_content(data, maintype=maintype, subtype=subtype, filename=os.path.basename(path))
+    payload = part.get_payload()
+    part.encoded_body = payload.replace("\n", "\r\n").encode("ascii")
+    return part, len(payload) + len(part.encoded_body), len(data)
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+# Append-only record of every message the mail merge attempts, so an
+# interrupted run can be resumed instead of restarted.
+#
+# Each line of the journal is one JSON object:
+#   {"key": ..., "to": ..., "file": ..., "status": "sent" | "failed", "error": ..., "ts": ...}
+# The key is the recipient plus a fingerprint of the attachment (name, size
+# and modification time), so replacing a file with a corrected version
+# sends it again. The newest line for a key wins. Lines are buffered and
+# fsynced in batches rather than once per message.
+
+SENT = "sent"
+FAILED = "failed"
+RESUME_MODES = ("Skip already sent", "Retry failed only", "Send all")
+
+
+def message_key(to_email, attachment_path):
+    to_email = str(to_email).strip().lower()
+    if not attachment_path:
+        return to_email
+    stat = os.stat(attachment_path)
+    fingerprint = f"{os.path.basename(attachment_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return to_email + "|" + hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+
+class SendJournal:
+    def __init__(self, path, sync_every=200, sync_seconds=2.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.status = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n")
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last line half written
+                    continue
+                self.status[entry["key"]] = entry["status"]
+
+    def is_sent(self, key):
+        return self.status.get(key) == SENT
+
+    def has_failed(self, key):
+        return self.status.get(key) == FAILED
+
+    def should_skip(self, key, mode):
+        # Whether a run in the given RESUME_MODES mode leaves this message out
+        if mode == RESUME_MODES[0]:
+            return self.is_sent(key)
+        if mode == RESUME_MODES[1]:
+            return not self.has_failed(key)
+        return False
+
+    def counts(self):
+        sent = sum(1 for s in self.status.values() if s == SENT)
+        return {"sent": sent, "failed": len(self.status) - sent}
+
+    def record(self, key, to_email, file_name, status, error=None):
+        entry = {"key": key, "to": str(to_email), "file": file_name, "status": status,
+                 "error": error, "ts": time.time()}
+        with self._lock:
+            self.status[key] = status
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._pending += 1
+            if self._pending >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_seconds:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
@@ -0,0 +1,281 @@
+import heapq
+import random
+import smtplib
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+
+
+# Sending policy on top of a transport (see mail_transport):
+#
+#   - a token bucket caps messages per second; the rate halves when the
+#     server pushes back (4xx, dropped connections) and creeps back up to
+#     the configured maximum as messages go through
+#   - at most `per_domain` messages are in flight to any one domain; the
+#     rest wait in that domain's backlog while other domains keep sending
+#   - transient failures are retried with exponential backoff and full
+#     jitter; permanent failures (5xx, bad address) go to `dead_letters`
+#     and the rest of the batch carries on
+#
+# metrics() gives sent/s, retry queue depth and failure rate while the run
+# is going.
+
+
+def is_transient(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError,
+                              ConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None, min_rate=None):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min_rate or self.max_rate / 10
+        self.burst = burst or max(1.0, self.rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.slowed = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self):
+        # A burst of rejections is one signal, so halve at most once a second
+        with self._lock:
+            now = time.monotonic()
+            if now - self.slowed >= 1.0:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.slowed = now
+
+    def speed_up(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class SendScheduler:
+    def __init__(self, transport, per_second=None, per_domain=None, max_attempts=4,
+                 base_delay=1.0, max_delay=60.0):
+        self.transport = transport
+        self.bucket = TokenBucket(per_second) if per_second else None
+        self.per_domain = per_domain
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letters = []
+        self.stats = {"sent": 0, "failed": 0, "retries": 0}
+        self.started = time.monotonic()
+
+        self._in_flight = defaultdict(int)
+        self._backlog = defaultdict(deque)
+        self._cv = threading.Condition()
+        self._retry_queue = []
+        self._pending = 0
+        self._seq = 0
+        self._closing = False
+        # Outlook's COM object may only be used from the thread that opened
+        # it, so for such transports retries run on the submitting thread.
+        self._inline_retries = not getattr(transport, "thread_safe", True)
+        self._retry_thread = None
+
+    def open(self):
+        self.transport.open()
+        if not self._inline_retries:
+            self._retry_thread = threading.Thread(target=self._retry_loop, daemon=True)
+            self._retry_thread.start()
+
+    def submit(self, to_email, subject, html, attachment_path=None):
+        outcome = Future()
+        with self._cv:
+            self._pending += 1
+        if self._inline_retries:
+            self._run_due_retries()
+        # [to, subject, html, attachment, outcome, attempt, holds a domain slot]
+        self._dispatch([to_email, subject, html, attachment_path, outcome, 1, False])
+        return outcome
+
+    def _domain(self, to_email):
+        if not self.per_domain:
+            return None
+        return str(to_email).rsplit("@", 1)[-1].lower()
+
+    def _dispatch(self, job):
+        to_email, subject, html, attachment_path, outcome = job[:5]
+        domain = self._domain(to_email)
+        if domain is not None:
+            with self._cv:
+                if job[6]:
+                    job[6] = False
+                elif self._in_flight[domain] >= self.per_domain:
+                    # Parked rather than waited for, so a busy domain never
+                    # holds up messages to the others
+                    self._backlog[domain].append(job)
+                    return
+                else:
+                    self._in_flight[domain] += 1
+        if self.bucket:
+            self.bucket.acquire()
+        try:
+            sent = self.transport.submit(to_email, subject, html, attachment_path)
+        except Exception as e:
+            self._release(domain)
+            self._settle(outcome, error=e)
+            return
+        sent.add_done_callback(lambda f: self._finished(job, f, domain))
+
+    def _release(self, domain):
+        # Hands the finished message's slot to the next one parked for the
+        # domain. It goes through the retry queue, so it is sent from the
+        # retry thread (or the submitting thread for Outlook), never from
+        # the transport's worker that is completing this message.
+        if domain is None:
+            return
+        with self._cv:
+            backlog = self._backlog.get(domain)
+            if backlog:
+                job = backlog.popleft()
+                job[6] = True
+                self._seq += 1
+                heapq.heappush(self._retry_queue, (time.monotonic(), self._seq, job))
+                self._cv.notify_all()
+            else:
+                self._in_flight[domain] -= 1
+
+    def _finished(self, job, sent, domain):
+        self._release(domain)
+        outcome, attempt = job[4], job[5]
+        if sent.cancelled():
+            self._settle(outcome, cancelled=True)
+            return
+        error = sent.exception()
+        if error is None:
+            if self.bucket:
+                self.bucket.speed_up()
+            with self._cv:
+                self.stats["sent"] += 1
+            self._settle(outcome, result=sent.result())
+            return
+
+        if is_transient(error) and attempt < self.max_attempts and not self._closing:
+            if self.bucket:
+                self.bucket.slow_down()
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+            job[5] = attempt + 1
+            with self._cv:
+                self.stats["retries"] += 1
+                self._seq += 1
+                heapq.heappush(self._retry_queue, (time.monotonic() + delay, self._seq, job))
+                self._cv.notify_all()
+            return
+
+        with self._cv:
+            self.stats["failed"] += 1
+            self.dead_letters.append((job[0], job[3], str(error)))
+        self._settle(outcome, error=error)
+
+    def _settle(self, outcome, result=None, error=None, cancelled=False):
+        if cancelled:
+            outcome.cancel()
+        elif error is not None:
+            outcome.set_exception(error)
+        else:
+            outcome.set_result(result)
+        with self._cv:
+            self._pending -= 1
+            self._cv.notify_all()
+
+    def _next_retry(self, wait):
+        # Pops the next retry once it is due; None when nothing is due (or,
+        # with wait=True, when the scheduler is closing with nothing queued)
+        with self._cv:
+            while not self._retry_queue or self._retry_queue[0][0] > time.monotonic():
+                if not wait or (self._closing and not self._retry_queue):
+                    return None
+                timeout = self._retry_queue[0][0] - time.monotonic() if self._retry_queue else None
+                self._cv.wait(timeout)
+            return heapq.heappop(self._retry_queue)[2]
+
+    def _run_due_retries(self):
+        job = self._next_retry(wait=False)
+        while job is not None:
+            self._dispatch(job)
+            job = self._next_retry(wait=False)
+
+    def _retry_loop(self):
+        job = self._next_retry(wait=True)
+        while job is not None:
+            self._dispatch(job)
+            job = self._next_retry(wait=True)
+
+    def metrics(self):
+        with self._cv:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            done = self.stats["sent"] + self.stats["failed"]
+            waiting = sum(len(backlog) for backlog in self._backlog.values())
+            return {
+                "sent_per_second": self.stats["sent"] / elapsed,
+                "retry_queue": len(self._retry_queue),
+                "domain_backlog": waiting,
+                "in_flight": self._pending - len(self._retry_queue) - waiting,
+                "failure_rate": self.stats["failed"] / done if done else 0.0,
+                "rate_limit": self.bucket.rate if self.bucket else None,
+                **self.stats,
+            }
+
+    def describe(self):
+        m = self.metrics()
+        text = (f"{m['sent_per_second']:.1f} sent/s  •  retry queue {m['retry_queue']}"
+                f"  •  failures {m['failure_rate']:.1%}")
+        if m["rate_limit"] is not None:
+            text += f"  •  limit {m['rate_limit']:.1f}/s"
+        return text
+
+    def close(self, cancel=False):
+        with self._cv:
+            if cancel:
+                self._closing = True
+                for _, _, job in self._retry_queue:
+                    job[4].cancel()
+                    self._pending -= 1
+                self._retry_queue = []
+                for backlog in self._backlog.values():
+                    for job in backlog:
+                        job[4].cancel()
+                        self._pending -= 1
+                self._backlog.clear()
+                self._cv.notify_all()
+        if cancel:
+            self.transport.close(cancel=True)
+        while True:
+            with self._cv:
+                if self._pending <= 0:
+                    break
+                if not (self._inline_retries and self._retry_queue):
+                    self._cv.wait(0.5)
+                    continue
+                delay = self._retry_queue[0][0] - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._run_due_retries()
+        with self._cv:
+            self._closing = True
+            self._cv.notify_all()
+        if self._retry_thread is not None:
+            self._retry_thread.join()
+        if not cancel:
+            self.transport.close()
@@ -0,0 +1,71 @@
+import re
+import html as html_lib
+from mail_transport import build_html
+from excel_input import cell_text
+
+
+# Per-recipient subject and bilingual body for the mail merge.
+#
+# The subject and both message boxes may contain {{Column Name}}
+# placeholders. They are compiled once per run into literal parts plus
+# column slots, checked against the sheet's columns, and then rendered for
+# every row with a single join. Values substituted into the HTML body are
+# escaped; the text typed in the boxes is used as-is, as before.
+
+PLACEHOLDER = re.compile(r"\{\{\s*(.+?)\s*\}\}")
+
+
+class CompiledTemplate:
+    def __init__(self, text, escape=False):
+        self.parts = []
+        self.fields = []
+        last = 0
+        for m in PLACEHOLDER.finditer(text):
+            self.parts.append(text[last:m.start()])
+            self.fields.append(m.group(1))
+            last = m.end()
+        self.parts.append(text[last:])
+        self.escape = escape
+
+    def render(self, values):
+        # values: one already-formatted string per entry in self.fields
+        if not self.fields:
+            return self.parts[0]
+        if self.escape:
+            values = [html_lib.escape(v) for v in values]
+        out = [self.parts[0]]
+        for value, part in zip(values, self.parts[1:]):
+            out.append(value)
+            out.append(part)
+        return "".join(out)
+
+
+class MessageTemplate:
+    def __init__(self, subject, english, arabic, columns):
+        self.subject = CompiledTemplate(subject)
+        body = build_html(english.replace("\n", "<br>"), arabic.replace("\n", "<br>"))
+        self.body = CompiledTemplate(body, escape=True)
+
+        names = {str(c): c for c in columns}
+        unknown = sorted({f for f in self.subject.fields + self.body.fields if f not in names})
+        if unknown:
+            raise ValueError("Unknown column(s) in message: " + ", ".join("{{" + f + "}}" for f in unknown))
+        self.columns = [names[f] for f in dict.fromkeys(self.subject.fields + self.body.fields)]
+        position = {str(c): i for i, c in enumerate(self.columns)}
+        self._subject_slots = [position[f] for f in self.subject.fields]
+        self._body_slots = [position[f] for f in self.body.fields]
+
+    def render_rows(self, df):
+        # Yields (subject, html) per row, reading only the referenced columns
+        if not self.columns:
+            rendered = (self.subject.render([]), self.body.render([]))
+            for _ in range(len(df)):
+                yield rendered
+            return
+        arrays = [[cell_text(v) or "" for v in df[c].tolist()] for c in self.columns]
+        for row in zip(*arrays):
+            yield (self.subject.render([row[i] for i in self._subject_slots]),
+                   self.body.render([row[i] for i in self._body_slots]))
+
+    def preview(self, df, n=5):
+        return list(self.render_rows(df.head(n)))
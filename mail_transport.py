@@ -0,0 +1,223 @@
+import io
+import ssl
+import smtplib
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from email.generator import BytesGenerator
+from email.message import EmailMessage
+from email.utils import make_msgid
+from mail_attachments import EncodedAttachments, attachment_paths
+
+
+# Outbound mail transports for the mail merge.
+#
+# Every transport has the same small interface:
+#
+#   transport.open()                       # in the thread that will send
+#   future = transport.submit(to, subject, html, attachment_path)
+#   transport.close(cancel=False)
+#
+# attachment_path is one path or a list of paths (e.g. the row's own file
+# plus a common attachment sent to everyone).
+#
+# submit() returns a concurrent.futures.Future that resolves when the
+# message is accepted (or fails). OutlookTransport sends inline through one
+# Outlook.Application; SmtpTransport keeps a pool of authenticated SMTP
+# connections open and sends from several threads at once. Rate limits and
+# retries live in mail_scheduler.SendScheduler, which wraps a transport.
+
+TRANSPORTS = ("Outlook", "SMTP")
+
+
+def build_html(english_html, arabic_html):
+    return f"""
+    <html>
+        <body>
+            <table border="0" style="width:100%;">
+                <tr>
+                    <td style="width:50%;">
+                        <div dir='ltr' style='text-align:left; font-family:Sakkal Majalla, serif; font-size:14pt;'>
+                            {english_html}
+                        </div>
+                    </td>
+                    <td style="width:50%;">
+                        <div dir='rtl' style='text-align:right; font-family:Sakkal Majalla, serif; font-size:14pt;'>
+                            {arabic_html}
+                        </div>
+                    </td>
+                </tr>
+            </table>
+        </body>
+    </html>
+    """
+
+
+class OutlookTransport:
+    thread_safe = False
+    # Outlook reads and encodes attached files itself, from their paths
+    attachments = None
+
+    def __init__(self):
+        self.outlook = None
+
+    def open(self):
+        # COM must be initialised in the thread that talks to Outlook
+        import pythoncom
+        import win32com.client as win32
+        pythoncom.CoInitialize()
+        self.outlook = win32.Dispatch('Outlook.Application')
+
+    def submit(self, to_email, subject, html, attachment_path=None):
+        future = Future()
+        try:
+            mail = self.outlook.CreateItem(0)
+            mail.To = to_email
+            mail.Subject = subject
+            mail.HTMLBody = html
+            for path in attachment_paths(attachment_path):
+                mail.Attachments.Add(path)
+            mail.Send()
+            future.set_result(to_email)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def close(self, cancel=False):
+        if self.outlook is None:
+            return
+        import pythoncom
+        self.outlook = None
+        pythoncom.CoUninitialize()
+
+
+class _EncodedPartGenerator(BytesGenerator):
+    # Writes the pre-encoded body of a cached attachment part in one go
+    def _dispatch(self, msg):
+        body = getattr(msg, "encoded_body", None)
+        if body is None or self._NL != "\r\n":
+            return super()._dispatch(msg)
+        self._fp.write(body)
+
+
+class SmtpTransport:
+    def __init__(self, host, port=587, username="", password="", sender="", security="starttls",
+                 connections=4, max_in_flight=None, messages_per_connection=None, timeout=60,
+                 attachments=None):
+        self.host = host
+        self.port = int(port)
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.security = security  # "starttls", "ssl" or "none"
+        self.connections = max(1, int(connections))
+        self.messages_per_connection = messages_per_connection
+        self.timeout = timeout
+        # Each attachment file is read and encoded once per run
+        self.attachments = attachments if attachments is not None else EncodedAttachments()
+        self._in_flight = threading.BoundedSemaphore(max_in_flight or self.connections * 2)
+        self._local = threading.local()
+        self._open = []
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def open(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix="smtp")
+
+    def _connect(self):
+        if self.security == "ssl":
+            conn = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout,
+                                    context=ssl.create_default_context())
+        else:
+            conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.security == "starttls":
+                conn.starttls(context=ssl.create_default_context())
+        if self.username:
+            conn.login(self.username, self.password)
+        with self._lock:
+            self._open.append(conn)
+        return conn
+
+    def _drop(self, conn):
+        with self._lock:
+            if conn in self._open:
+                self._open.remove(conn)
+        try:
+            conn.quit()
+        except Exception:
+            pass
+
+    def _connection(self):
+        # One persistent connection per pool thread, reused across messages
+        conn = getattr(self._local, "conn", None)
+        limit = self.messages_per_connection
+        if conn is not None and limit and self._local.sent >= limit:
+            self._drop(conn)
+            conn = None
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            self._local.sent = 0
+        return conn
+
+    def build_message(self, to_email, subject, html, attachment_path=None):
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        msg["Message-ID"] = make_msgid()
+        msg.set_content(html, subtype="html")
+        paths = attachment_paths(attachment_path)
+        if paths:
+            msg.make_mixed()
+            # "=_" never occurs in base64 or quoted-printable text, so the
+            # generator doesn't have to scan the attachments for a clash
+            msg.set_boundary(f"=_{uuid.uuid4().hex}")
+            for path in paths:
+                msg.attach(self.attachments.part(path))
+        return msg
+
+    def flatten(self, msg):
+        # The bytes smtplib's send_message would put on the wire
+        out = io.BytesIO()
+        _EncodedPartGenerator(out, policy=msg.policy).flatten(msg, linesep="\r\n")
+        return out.getvalue()
+
+    def _deliver(self, conn, msg, to_email):
+        if not (self.sender + str(to_email)).isascii():
+            # SMTPUTF8 addresses: let smtplib negotiate it
+            conn.send_message(msg)
+        else:
+            conn.sendmail(self.sender, [to_email], self.flatten(msg))
+
+    def _send(self, to_email, subject, html, attachment_path):
+        try:
+            msg = self.build_message(to_email, subject, html, attachment_path)
+            for attempt in (1, 2):
+                conn = self._connection()
+                try:
+                    self._deliver(conn, msg, to_email)
+                    self._local.sent += 1
+                    return to_email
+                except smtplib.SMTPServerDisconnected:
+                    # Server closed an idle connection; reconnect once
+                    self._local.conn = None
+                    self._drop(conn)
+                    if attempt == 2:
+                        raise
+        finally:
+            self._in_flight.release()
+
+    def submit(self, to_email, subject, html, attachment_path=None):
+        self._in_flight.acquire()
+        try:
+            return self._pool.submit(self._send, to_email, subject, html, attachment_path)
+        except Exception:
+            self._in_flight.release()
+            raise
+
+    def close(self, cancel=False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=cancel)
+            self._pool = None
+        for conn in list(self._open):
+            self._drop(conn)
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import threading
+
+
+# Opt-in stage timing and profiling for both tools.
+#
+# Set EXAM_TOOLS_PROFILE to a folder (or to 1 for ./run_profiles), or pass
+# --profile to distribute_cli, and every analyze / export / send run
+# writes there:
+#
+#   <run>_<timestamp>.json    wall time, per-stage seconds and call counts,
+#                             counters (rows, bytes written, messages sent),
+#                             peak memory
+#
+# cProfile slows a run down several times over, so it is a separate
+# switch: EXAM_TOOLS_CPROFILE=1 (or --cprofile) also writes
+#
+#   <run>_<timestamp>.pstats  cProfile of the thread that ran the job
+#                             (python -m pstats <file>)
+#
+# into the same folder (./run_profiles when none is set). When both are
+# off, run_metrics() returns NULL_METRICS, whose stage()
+# hands back one shared do-nothing context manager, so the instrumented
+# code costs an attribute lookup and a call per stage.
+
+PROFILE_ENV = "EXAM_TOOLS_PROFILE"
+CPROFILE_ENV = "EXAM_TOOLS_CPROFILE"
+DEFAULT_FOLDER = "run_profiles"
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullMetrics:
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def count(self, name, amount=1):
+        pass
+
+    def iterate(self, name, iterable):
+        return iterable
+
+    def start(self):
+        return self
+
+    def finish(self, **extra):
+        return None
+
+
+NULL_METRICS = NullMetrics()
+
+
+class _Stage:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class RunMetrics:
+    enabled = True
+
+    def __init__(self, name, folder, profile=False):
+        self.name = name
+        self.folder = folder
+        self.profile = profile
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._started = None
+        self._started_at = None
+
+    def stage(self, name):
+        # Time spent in a stage adds up when it is entered more than once
+        return _Stage(self, name)
+
+    def _add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def iterate(self, name, iterable):
+        # Times producing each item of a generator (e.g. rows rendered lazily)
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def start(self):
+        self._started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self._started = time.perf_counter()
+        if self.profile:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def finish(self, **extra):
+        # Stops the profiler, writes the JSON summary (and .pstats) and
+        # returns the summary
+        if self._profiler is not None:
+            self._profiler.disable()
+
+        os.makedirs(self.folder, exist_ok=True)
+        base = os.path.join(self.folder, f"{self.name}_{time.strftime('%Y%m%d_%H%M%S')}")
+        with self._lock:
+            summary = {
+                "run": self.name,
+                "started": self._started_at,
+                "seconds": round(time.perf_counter() - self._started, 4),
+                "stages": {name: {"seconds": round(s["seconds"], 4), "calls": s["calls"]}
+                           for name, s in self.stages.items()},
+                "counters": dict(self.counters),
+                "peak_rss_mb": peak_rss_mb(),
+                **extra,
+            }
+        if self._profiler is not None:
+            summary["profile"] = base + ".pstats"
+            self._profiler.dump_stats(summary["profile"])
+            self._profiler = None
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        summary["summary"] = base + ".json"
+        return summary
+
+
+def run_metrics(name, folder=None, cprofile=None):
+    # RunMetrics when timing or cProfile is switched on, NULL_METRICS
+    # otherwise
+    folder = folder or os.environ.get(PROFILE_ENV)
+    if folder == "0":
+        folder = None
+    if cprofile is None:
+        cprofile = os.environ.get(CPROFILE_ENV, "0") not in ("", "0")
+    if not folder and not cprofile:
+        return NULL_METRICS
+    return RunMetrics(name, DEFAULT_FOLDER if not folder or folder == "1" else folder, cprofile)
+
+
+def profiled(name, work):
+    # Wraps a BackgroundJob work function as work(ctx, metrics), started and
+    # finished around the job on its own thread
+    def run(ctx):
+        metrics = run_metrics(name).start()
+        try:
+            return work(ctx, metrics)
+        finally:
+            metrics.finish()
+    return run
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import subprocess
+import pytest
+from distribute_cli import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, *args], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    return result, time.perf_counter() - started
+
+
+def test_help_starts_quickly():
+    result, seconds = run_python("-m", "distribute_cli", "--help")
+    assert result.returncode == 0, result.stderr
+    assert "usage: distribute_cli" in result.stdout
+    assert seconds < 1.0
+
+
+def test_parsing_does_not_import_heavy_modules():
+    code = ("import sys, distribute_cli\n"
+            "distribute_cli.build_parser().parse_args(['roster.xlsx', '--config', 'centers.json'])\n"
+            "print(','.join(m for m in ('pandas', 'numpy', 'tkinter') if m in sys.modules))\n")
+    result, _ = run_python("-c", code)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ""
+
+
+def test_incremental_rejects_other_strategies(capsys):
+    for extra in (["--strategy", "balanced"], ["--group-by", "School"]):
+        with pytest.raises(SystemExit) as exit_info:
+            main(["roster.xlsx", "--config", "centers.json", "--incremental", "--id-column", "ID", *extra])
+        assert exit_info.value.code == 2
+        assert "--incremental only works with the sequential strategy" in capsys.readouterr().err
+
+
+ROUNDS = [{"from": "08:00", "to": "10:00"}]
+
+
+@pytest.mark.parametrize("config, args, message", [
+    ({"centers": [{"name": "A", "labs": [{"name": "L", "capacity": 10}]}]}, [], "no rounds"),
+    ({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": 0}]}]}, [], "no seats"),
+    ({"rounds": ROUNDS, "centers": [{"labs": [{"name": "L", "capacity": 1}]}]}, [], "missing 'name'"),
+    ({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": "x"}]}]}, [], "invalid config"),
+    ({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": 5}]}]}, ["--rounds", "0"],
+     "--rounds must be greater than zero"),
+    ({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": 5}]}]},
+     ["--publish", "env", "--name-column", "Name", "--id-column", "ID"], "DATABASE_URL"),
+    ({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": 5}]}]},
+     ["--publish", "postgresql://db", "--name-column", "Name", "--id-column", "ID", "--prune-withdrawn"],
+     "--prune-withdrawn needs --publish and --assessment-id"),
+])
+def test_bad_input_is_reported_without_a_traceback(tmp_path, capsys, monkeypatch, config, args, message):
+    import json
+
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    path = tmp_path / "centers.json"
+    path.write_text(json.dumps(config))
+    with pytest.raises(SystemExit) as exit_info:
+        main(["roster.xlsx", "--config", str(path), *args])
+    assert exit_info.value.code == 2
+    assert message in capsys.readouterr().err
+
+
+def test_unreadable_config_and_unknown_column(tmp_path, capsys, monkeypatch):
+    import json
+    import pandas as pd
+    import excel_input
+
+    bad = tmp_path / "bad.json"
+    bad.write_text('{"rounds": [')
+    with pytest.raises(SystemExit):
+        main(["roster.xlsx", "--config", str(bad)])
+    assert "invalid config" in capsys.readouterr().err
+
+    monkeypatch.setattr(excel_input, "CACHE_DIR", str(tmp_path / "cache"))
+    workbook = tmp_path / "roster.xlsx"
+    pd.DataFrame({"ID": [1, 2], "Name": ["a", "b"]}).to_excel(workbook, index=False)
+    config = tmp_path / "centers.json"
+    config.write_text(json.dumps({"rounds": ROUNDS, "centers": [{"name": "A", "labs": [{"name": "L", "capacity": 5}]}]}))
+    with pytest.raises(SystemExit) as exit_info:
+        main([str(workbook), "--config", str(config), "--report-only", "--incremental", "--id-column", "Nope"])
+    assert exit_info.value.code == "distribute_cli: error: not a column of the sheet: Nope"
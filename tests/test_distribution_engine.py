@@ -0,0 +1,93 @@
+import random
+import pandas as pd
+import pytest
+from distribution_engine import capacity_matrix, plan_seats, iter_assigned_rounds, analyze
+
+
+def reference_rounds(df, labs, rounds, round_times):
+    # The distributor's original seat-by-seat walk (per-round capacities
+    # repeat their last value, as capacity_matrix does)
+    def cap(lab, r):
+        c = lab[2]
+        return c[min(r - 1, len(c) - 1)] if isinstance(c, (list, tuple)) else c
+
+    out = []
+    idx = 0
+    d = 0
+    while idx < len(df):
+        d += 1
+        for r in range(1, rounds + 1):
+            round_data = []
+            for lab in labs:
+                cname, lname, _, clink = lab
+                for _ in range(cap(lab, r)):
+                    if idx >= len(df):
+                        break
+                    row = df.iloc[idx].copy()
+                    row["Center"] = cname
+                    row["Lab"] = lname
+                    row["Day Number"] = d
+                    row["Time"] = f"{round_times[r - 1][0]} - {round_times[r - 1][1]}"
+                    row["Round Number"] = r
+                    row["Center Link"] = clink
+                    round_data.append(row)
+                    idx += 1
+            if round_data:
+                out.append((d, r, pd.DataFrame(round_data).reset_index(drop=True)))
+            if idx >= len(df):
+                break
+    return out
+
+
+def random_case(rng):
+    rounds = rng.randint(1, 4)
+    labs = []
+    for c in range(rng.randint(1, 3)):
+        for l in range(rng.randint(1, 4)):
+            if rng.random() < 0.3:
+                capacity = tuple(rng.randint(0, 6) for _ in range(rng.randint(1, rounds)))
+            else:
+                capacity = rng.choice([0, rng.randint(1, 8)])
+            labs.append((f"Center {c}", f"Lab {l}", capacity, f"https://maps/{c}"))
+    if not capacity_matrix(labs, rounds).sum():
+        labs.append(("Center X", "Lab X", 1, "https://maps/x"))
+    total = rng.choice([0, rng.randint(1, 120)])
+    df = pd.DataFrame({"ID": range(1000, 1000 + total), "Name": [f"n{i}" for i in range(total)]})
+    round_times = [(f"{8 + r}:00", f"{9 + r}:00") for r in range(rounds)]
+    return df, labs, rounds, round_times
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_rounds_match_the_seat_by_seat_walk(seed):
+    df, labs, rounds, round_times = random_case(random.Random(seed))
+    plan = plan_seats(len(df), capacity_matrix(labs, rounds), rounds)
+    got = [(d, r, frame.reset_index(drop=True)) for d, r, frame in iter_assigned_rounds(df, labs, plan, round_times)]
+    expected = reference_rounds(df, labs, rounds, round_times)
+    assert [(d, r) for d, r, _ in got] == [(d, r) for d, r, _ in expected]
+    for (_, _, frame), (_, _, ref) in zip(got, expected):
+        pd.testing.assert_frame_equal(frame, ref, check_dtype=False)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_summary_counts_every_examinee_once(seed):
+    df, labs, rounds, round_times = random_case(random.Random(seed))
+    result = analyze(df, labs, rounds)
+    expected = {}
+    for d, r, frame in reference_rounds(df, labs, rounds, round_times):
+        expected.setdefault(d, [0] * rounds)[r - 1] = len(frame)
+    assert result["summary"] == expected
+    assert result["days"] == len(expected)
+
+
+def test_empty_roster():
+    labs = [("Center A", "Lab 1", 0, ""), ("Center A", "Lab 2", 5, "")]
+    df = pd.DataFrame({"ID": []})
+    plan = plan_seats(0, capacity_matrix(labs, 2), 2)
+    assert list(iter_assigned_rounds(df, labs, plan, [("8", "9"), ("10", "11")])) == []
+    assert plan["days"] == 0 and plan["summary"] == {}
+
+
+def test_no_capacity_is_rejected():
+    labs = [("Center A", "Lab 1", 0, "")]
+    with pytest.raises(ValueError):
+        plan_seats(10, capacity_matrix(labs, 2), 2)
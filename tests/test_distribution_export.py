@@ -0,0 +1,80 @@
+import os
+import pandas as pd
+import pytest
+from distribution_engine import analyze, capacity_matrix, stream_plan
+from distribution_export import export_distribution, export_stream
+
+LABS = [("Center A", "Lab 1", 3, "https://maps/a"), ("Center B", "Lab 1", 2, "https://maps/b")]
+ROUND_TIMES = [("08:00", "10:00"), ("11:00", "13:00")]
+
+
+def read_rounds(base, fmt):
+    read = pd.read_parquet if fmt == "parquet" else pd.read_csv
+    return {name: read(os.path.join(base, name)) for name in sorted(os.listdir(base))}
+
+
+def test_parquet_writes_columns_mixing_numbers_and_text(tmp_path):
+    df = pd.DataFrame({"ID": [1, "A2", 3, None, 5.0, "B6", 7], "Name": list("abcdefg")})
+    plan = analyze(df, LABS, 2)["plan"]
+    export_distribution(df, LABS, plan, ROUND_TIMES, str(tmp_path), "parquet")
+    rounds = read_rounds(str(tmp_path), "parquet")
+    assert list(rounds) == ["Day_1_Round_1.parquet", "Day_1_Round_2.parquet"]
+    ids = pd.concat(rounds.values())["ID"]
+    assert ids.isna().tolist() == [False, False, False, True, False, False, False]
+    assert ids.dropna().tolist() == ["1", "A2", "3", "5", "B6", "7"]
+
+
+def test_streamed_parquet_with_chunks_of_different_types(tmp_path):
+    chunks = [pd.DataFrame({"ID": [1, 2, 3]}), pd.DataFrame({"ID": ["A4", "A5", "A6"]})]
+    plan = stream_plan(6, capacity_matrix(LABS, 2), 2)
+    result = export_stream(iter(chunks), LABS, plan, ROUND_TIMES, str(tmp_path), "parquet")
+    assert result["rows"] == 6
+    rounds = read_rounds(str(tmp_path), "parquet")
+    assert pd.concat(rounds.values())["ID"].tolist() == ["1", "2", "3", "A4", "A5", "A6"]
+
+
+def test_streamed_export_matches_whole_sheet_export(tmp_path, monkeypatch):
+    import excel_input
+    from excel_input import count_rows, iter_chunks, load_sheet
+
+    monkeypatch.setattr(excel_input, "CACHE_DIR", str(tmp_path / "cache"))
+    workbook = str(tmp_path / "roster.xlsx")
+    pd.DataFrame({"ID": [f"N{i:03d}" for i in range(23)], "Name": [f"Examinee {i}" for i in range(23)],
+                  "Score": [i * 1.5 for i in range(23)]}).to_excel(workbook, index=False)
+
+    df = load_sheet(workbook)
+    export_distribution(df, LABS, analyze(df, LABS, 2)["plan"], ROUND_TIMES, str(tmp_path / "whole"), "csv")
+    expected = read_rounds(str(tmp_path / "whole"), "csv")
+
+    # From the Feather sidecar load_sheet left behind, then from the workbook itself
+    excel_input._frames.clear()
+    assert excel_input._cached_feather(workbook, 0) is not None
+    for source in ("sidecar", "workbook"):
+        if source == "workbook":
+            monkeypatch.setattr(excel_input, "CACHE_DIR", str(tmp_path / "empty"))
+        total = count_rows(workbook)
+        assert total == 23
+        plan = stream_plan(total, capacity_matrix(LABS, 2), 2)
+        out = str(tmp_path / source)
+        export_stream(iter_chunks(workbook, chunk_rows=4), LABS, plan, ROUND_TIMES, out, "csv")
+        streamed = read_rounds(out, "csv")
+        assert list(streamed) == list(expected)
+        for name in expected:
+            pd.testing.assert_frame_equal(streamed[name], expected[name])
+
+
+def test_feather_sidecar_is_streamed_batch_by_batch(tmp_path):
+    import pyarrow.feather
+    from excel_input import _feather_chunks, _feather_rows
+
+    path = str(tmp_path / "frame.feather")
+    df = pd.DataFrame({"ID": range(23), "Name": [f"n{i}" for i in range(23)]})
+    pyarrow.feather.write_feather(df, path, chunksize=5)
+    assert _feather_rows(path) == 23
+
+    chunks = list(_feather_chunks(path, ["Name"], 7))
+    assert [len(c) for c in chunks] == [7, 7, 7, 2]
+    assert [c.index[0] for c in chunks] == [0, 7, 14, 21]
+    pd.testing.assert_frame_equal(pd.concat(chunks), df[["Name"]])
+    with pytest.raises(ValueError, match="Nope"):
+        list(_feather_chunks(path, ["Nope"], 7))
@@ -0,0 +1,108 @@
+import os
+import glob
+import pandas as pd
+import pytest
+from distribution_state import incremental_plan, export_changed, load_state
+
+LABS = [("Center A", "Lab 1", 10, "https://maps/a"), ("Center A", "Lab 2", 15, "https://maps/a")]
+ROUNDS = 2
+ROUND_TIMES = [("08:00", "10:00"), ("11:00", "13:00")]
+
+
+def roster(ids):
+    return pd.DataFrame({"ID": list(ids), "Name": [f"Examinee {i}" for i in ids]})
+
+
+def publish(df, base, labs=LABS):
+    rows, plan, stats = incremental_plan(df, labs, ROUNDS, "ID", load_state(base))
+    result = export_changed(rows, labs, plan, ROUND_TIMES, "ID", base, "csv")
+    seats = {str(key): (int(d), int(r), str(labs[l][0]), str(labs[l][1]), int(s))
+             for key, d, r, l, s in zip(rows["ID"], plan["day"], plan["round"], plan["lab"], plan["seat"])}
+    return seats, stats, result
+
+
+def day_files(base, d):
+    return glob.glob(os.path.join(base, f"Day_{d}_Round_*.csv"))
+
+
+def test_kept_examinees_keep_their_seats_and_only_changed_days_are_rewritten(tmp_path):
+    base = str(tmp_path / "out")
+    # 50 seats a day: days 1-3 full, day 4 holds 30
+    first, _, result = publish(roster(range(1000, 1180)), base)
+    assert result["days_written"] == [1, 2, 3, 4]
+    for path in glob.glob(os.path.join(base, "*.csv")):
+        os.utime(path, (0, 0))
+
+    withdrawn = [1060, 1061, 1075]
+    assert {first[str(i)][0] for i in withdrawn} == {2}
+    ids = [i for i in range(1000, 1180) if i not in withdrawn] + list(range(2000, 2005))
+    second, stats, result = publish(roster(ids), base)
+
+    assert stats == {"kept": 177, "moved": 0, "new": 5, "withdrawn": 3}
+    for key, seat in first.items():
+        if int(key) not in withdrawn:
+            assert second[key] == seat
+    assert len(set(second.values())) == len(second) == 182
+    # the 3 freed seats on day 2 go to new examinees, the other 2 join day 4
+    assert sorted(second[str(i)][0] for i in range(2000, 2005)) == [2, 2, 2, 4, 4]
+    assert result["days_written"] == [2, 4]
+    for d in (1, 3):
+        assert all(os.stat(path).st_mtime == 0 for path in day_files(base, d))
+    for d in (2, 4):
+        assert all(os.stat(path).st_mtime > 0 for path in day_files(base, d))
+
+    day2 = pd.concat(pd.read_csv(p) for p in day_files(base, 2))
+    assert set(withdrawn).isdisjoint(day2["ID"]) and {2000, 2001, 2002} <= set(day2["ID"])
+
+    _, stats, result = publish(roster(ids), base)
+    assert result["days_written"] == [] and stats["new"] == 0
+
+
+def test_examinees_on_removed_seats_move_without_sharing_a_seat(tmp_path):
+    base = str(tmp_path / "out")
+    first, _, _ = publish(roster(range(1000, 1120)), base)
+    smaller = [LABS[0], ("Center A", "Lab 2", 12, "https://maps/a")]
+    second, stats, _ = publish(roster(range(1000, 1120)), base, smaller)
+
+    lost = [key for key, seat in first.items() if seat[3] == "Lab 2" and seat[4] > 12]
+    assert stats["moved"] == len(lost) > 0
+    assert len(set(second.values())) == len(second) == 120
+    for key, seat in first.items():
+        if key not in lost:
+            assert second[key] == seat
+    assert all(seat[4] <= (10 if seat[3] == "Lab 1" else 12) for seat in second.values())
+
+
+def test_state_is_one_json_file_written_atomically(tmp_path):
+    import json
+    from distribution_state import STATE_FILE
+
+    base = str(tmp_path / "out")
+    publish(roster(range(1000, 1060)), base)
+    assert not [name for name in os.listdir(base) if name.endswith((".tmp", ".pkl"))]
+    with open(os.path.join(base, STATE_FILE), encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["id_column"] == "ID" and len(state["assignment"]["key"]) == 60
+    assert state["assignment"]["key"][:2] == ["1000", "1001"]
+
+
+@pytest.mark.parametrize("content", ['{"id_column": "ID", "format": "csv", "da', '{"id_column": "ID"}', "[]",
+                                     '{"id_column": "ID", "format": "csv", "days": {}, "assignment": {"key": []}}'])
+def test_unreadable_state_is_an_error_not_a_fresh_start(tmp_path, content):
+    from distribution_state import STATE_FILE
+
+    base = str(tmp_path / "out")
+    publish(roster(range(1000, 1060)), base)
+    with open(os.path.join(base, STATE_FILE), "w", encoding="utf-8") as f:
+        f.write(content)
+    with pytest.raises(ValueError, match="can't be read"):
+        publish(roster(range(1000, 1060)), base)
+
+
+def test_a_different_id_column_is_an_error(tmp_path):
+    base = str(tmp_path / "out")
+    df = roster(range(1000, 1060))
+    publish(df, base)
+    df["Other ID"] = df["ID"] + 1
+    with pytest.raises(ValueError, match="keyed on 'ID', not 'Other ID'"):
+        incremental_plan(df, LABS, ROUNDS, "Other ID", load_state(base))
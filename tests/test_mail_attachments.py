@@ -0,0 +1,110 @@
+import base64
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import mail_attachments
+from mail_attachments import EncodedAttachments
+
+
+def make_file(folder, name, size):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def test_repeated_file_is_encoded_once(tmp_path):
+    path = make_file(str(tmp_path), "schedule.pdf", 3000)
+    cache = EncodedAttachments()
+    first = cache.part(path)
+    assert cache.part(path) is first
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "bytes_read": 3000, "cached": 1,
+                             "cached_bytes": mail_attachments._encode(path)[1]}
+    assert base64.b64decode(first.encoded_body) == open(path, "rb").read()
+    assert first.get_filename() == "schedule.pdf"
+
+
+def test_changed_file_is_encoded_again(tmp_path):
+    path = make_file(str(tmp_path), "a.pdf", 1000)
+    cache = EncodedAttachments()
+    first = cache.part(path)
+    make_file(str(tmp_path), "a.pdf", 1200)
+    assert cache.part(path) is not first
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_parts_are_evicted_within_the_bound(tmp_path):
+    paths = [make_file(str(tmp_path), f"{i}.pdf", 1000) for i in range(4)]
+    size = mail_attachments._encode(paths[0])[1]
+    cache = EncodedAttachments(max_bytes=2 * size)
+    cache.part(paths[0])
+    cache.part(paths[1])
+    cache.part(paths[0])            # 0 is now the most recently used
+    cache.part(paths[2])            # evicts 1
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["cached"] == 2 and stats["cached_bytes"] <= cache.max_bytes
+    cache.part(paths[0])
+    assert cache.stats()["hits"] == 2
+    cache.part(paths[1])
+    assert cache.stats()["misses"] == 4
+
+
+def test_file_larger_than_the_bound_is_never_cached(tmp_path):
+    path = make_file(str(tmp_path), "big.pdf", 5000)
+    cache = EncodedAttachments(max_bytes=1000)
+    assert cache.part(path) is not cache.part(path)
+    assert cache.stats() == {"hits": 0, "misses": 2, "evictions": 0, "bytes_read": 10000, "cached": 0,
+                             "cached_bytes": 0}
+
+
+def test_concurrent_misses_share_one_encode(tmp_path, monkeypatch):
+    path = make_file(str(tmp_path), "common.pdf", 2000)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    encode = mail_attachments._encode
+
+    def slow_encode(p):
+        calls.append(p)
+        started.set()
+        release.wait(5)
+        return encode(p)
+
+    monkeypatch.setattr(mail_attachments, "_encode", slow_encode)
+    cache = EncodedAttachments()
+    with ThreadPoolExecutor(8) as pool:
+        first = pool.submit(cache.part, path)
+        assert started.wait(5)
+        rest = [pool.submit(cache.part, path) for _ in range(7)]
+        release.set()
+        parts = [first.result()] + [f.result() for f in rest]
+    assert len(calls) == 1
+    assert all(p is parts[0] for p in parts)
+    assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 7
+
+
+def test_failed_encode_reaches_every_waiter_and_is_retried(tmp_path, monkeypatch):
+    path = make_file(str(tmp_path), "common.pdf", 100)
+    started, release = threading.Event(), threading.Event()
+    encode = mail_attachments._encode
+
+    def failing_encode(p):
+        started.set()
+        release.wait(5)
+        raise OSError("disk went away")
+
+    monkeypatch.setattr(mail_attachments, "_encode", failing_encode)
+    cache = EncodedAttachments()
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(cache.part, path)
+        assert started.wait(5)
+        rest = [pool.submit(cache.part, path) for _ in range(3)]
+        release.set()
+        for future in [first] + rest:
+            with pytest.raises(OSError, match="disk went away"):
+                future.result()
+
+    monkeypatch.setattr(mail_attachments, "_encode", encode)
+    assert cache.part(path) is not None
+    assert cache.stats()["cached"] == 1
@@ -0,0 +1,64 @@
+import json
+import os
+import pytest
+from mail_journal import SendJournal, message_key, SENT, FAILED, RESUME_MODES
+
+SKIP_SENT, RETRY_FAILED, SEND_ALL = RESUME_MODES
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    path = str(tmp_path / "email_journal.jsonl")
+    journal = SendJournal(path)
+    journal.record("sent@x", "sent@x", "a.pdf", SENT)
+    journal.record("failed@x", "failed@x", "b.pdf", FAILED, "550 no such user")
+    journal.close()
+    return path
+
+
+@pytest.mark.parametrize("mode, skipped", [
+    (SKIP_SENT, {"sent@x"}),
+    (RETRY_FAILED, {"sent@x", "new@x"}),
+    (SEND_ALL, set()),
+])
+def test_resume_modes(journal_path, mode, skipped):
+    journal = SendJournal(journal_path)
+    assert {key for key in ("sent@x", "failed@x", "new@x") if journal.should_skip(key, mode)} == skipped
+    journal.close()
+
+
+def test_newest_entry_for_a_key_wins(journal_path):
+    journal = SendJournal(journal_path)
+    journal.record("sent@x", "sent@x", "a.pdf", FAILED, "421 try later")
+    journal.record("failed@x", "failed@x", "b.pdf", SENT)
+    journal.close()
+    journal = SendJournal(journal_path)
+    assert journal.has_failed("sent@x") and not journal.is_sent("sent@x")
+    assert journal.is_sent("failed@x") and not journal.has_failed("failed@x")
+    assert journal.counts() == {"sent": 1, "failed": 1}
+    journal.close()
+
+
+def test_torn_last_line_is_ignored_and_not_glued_to_the_next(journal_path):
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('{"key": "torn@x", "status": "se')
+    journal = SendJournal(journal_path)
+    assert journal.status == {"sent@x": SENT, "failed@x": FAILED}
+    journal.record("next@x", "next@x", "c.pdf", SENT)
+    journal.close()
+
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert json.loads(lines[-1])["key"] == "next@x"
+    assert SendJournal(journal_path).is_sent("next@x")
+
+
+def test_key_changes_when_the_attachment_is_replaced(tmp_path):
+    path = tmp_path / "card.pdf"
+    path.write_bytes(b"v1")
+    first = message_key(" Someone@Example.com ", str(path))
+    assert first.startswith("someone@example.com|")
+    path.write_bytes(b"version 2")
+    os.utime(path, ns=(0, 10 ** 9))
+    assert message_key("someone@example.com", str(path)) != first
+    assert message_key("someone@example.com", None) == "someone@example.com"
@@ -0,0 +1,188 @@
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import pytest
+import mail_scheduler
+from mail_scheduler import SendScheduler, TokenBucket, is_transient
+
+
+class GatedTransport:
+    # Sends to slow.example block until `gate` is set
+    thread_safe = True
+
+    def __init__(self):
+        self.gate = threading.Event()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.peak = {}
+        self.sent = []
+        self.pool = None
+
+    def open(self):
+        self.pool = ThreadPoolExecutor(8)
+
+    def submit(self, to_email, subject, html, attachment_path=None):
+        return self.pool.submit(self._send, to_email)
+
+    def _send(self, to_email):
+        domain = to_email.split("@")[1]
+        with self.lock:
+            self.active[domain] = self.active.get(domain, 0) + 1
+            self.peak[domain] = max(self.peak.get(domain, 0), self.active[domain])
+        if domain == "slow.example":
+            self.gate.wait(10)
+        with self.lock:
+            self.active[domain] -= 1
+            self.sent.append(to_email)
+        return to_email
+
+    def close(self, cancel=False):
+        self.pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+def test_busy_domain_does_not_block_other_domains():
+    transport = GatedTransport()
+    scheduler = SendScheduler(transport, per_domain=1)
+    scheduler.open()
+    slow = [scheduler.submit(f"s{i}@slow.example", "s", "h") for i in range(3)]
+    fast = [scheduler.submit(f"f{i}@fast.example", "s", "h") for i in range(5)]
+    done, _ = wait(fast, timeout=5)
+    assert len(done) == 5
+    assert not any(f.done() for f in slow)
+    assert scheduler.metrics()["domain_backlog"] == 2
+    transport.gate.set()
+    scheduler.close()
+    assert all(f.result() for f in slow)
+    assert transport.peak == {"slow.example": 1, "fast.example": 1}
+    assert sorted(transport.sent) == sorted([f"s{i}@slow.example" for i in range(3)] +
+                                            [f"f{i}@fast.example" for i in range(5)])
+
+
+def test_cancel_drops_parked_messages():
+    transport = GatedTransport()
+    scheduler = SendScheduler(transport, per_domain=1)
+    scheduler.open()
+    slow = [scheduler.submit(f"s{i}@slow.example", "s", "h") for i in range(3)]
+    transport.gate.set()
+    scheduler.close(cancel=True)
+    assert all(f.done() for f in slow)
+
+
+class ScriptedTransport:
+    # Fails each address with the errors queued for it, then succeeds
+    thread_safe = True
+
+    def __init__(self, errors=None):
+        self.errors = {to: list(queue) for to, queue in (errors or {}).items()}
+        self.attempts = {}
+        self.pool = None
+
+    def open(self):
+        self.pool = ThreadPoolExecutor(4)
+
+    def submit(self, to_email, subject, html, attachment_path=None):
+        return self.pool.submit(self._send, to_email)
+
+    def _send(self, to_email):
+        self.attempts[to_email] = self.attempts.get(to_email, 0) + 1
+        queue = self.errors.get(to_email)
+        if queue:
+            raise queue.pop(0)
+        return to_email
+
+    def close(self, cancel=False):
+        self.pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+def busy():
+    return smtplib.SMTPResponseException(451, b"try again later")
+
+
+@pytest.mark.parametrize("error, transient", [
+    (smtplib.SMTPResponseException(421, b"busy"), True),
+    (smtplib.SMTPResponseException(550, b"no such user"), False),
+    (smtplib.SMTPRecipientsRefused({"a@x": (450, b"greylisted")}), True),
+    (smtplib.SMTPRecipientsRefused({"a@x": (450, b"later"), "b@x": (550, b"unknown")}), False),
+    (smtplib.SMTPServerDisconnected("gone"), True),
+    (smtplib.SMTPConnectError(421, "no"), True),
+    (ConnectionResetError(), True),
+    (TimeoutError(), True),
+    (smtplib.SMTPAuthenticationError(535, b"bad password"), False),
+    (ValueError("bad address"), False),
+])
+def test_is_transient(error, transient):
+    assert is_transient(error) is transient
+
+
+def test_transient_failures_are_retried_until_they_succeed():
+    transport = ScriptedTransport({"a@x": [busy(), busy()]})
+    scheduler = SendScheduler(transport, max_attempts=4, base_delay=0.001, max_delay=0.01)
+    scheduler.open()
+    outcome = scheduler.submit("a@x", "s", "h")
+    scheduler.close()
+    assert outcome.result() == "a@x"
+    assert transport.attempts["a@x"] == 3
+    assert scheduler.stats == {"sent": 1, "failed": 0, "retries": 2}
+    assert scheduler.dead_letters == []
+
+
+def test_retries_stop_at_max_attempts_and_go_to_dead_letters():
+    transport = ScriptedTransport({"a@x": [busy() for _ in range(10)],
+                                   "b@x": [smtplib.SMTPResponseException(550, b"no such user")]})
+    scheduler = SendScheduler(transport, max_attempts=3, base_delay=0.001, max_delay=0.01)
+    scheduler.open()
+    outcomes = [scheduler.submit(to, "s", "h", f"{to}.pdf") for to in ("a@x", "b@x", "c@x")]
+    scheduler.close()
+    assert transport.attempts == {"a@x": 3, "b@x": 1, "c@x": 1}
+    assert isinstance(outcomes[0].exception(), smtplib.SMTPResponseException)
+    assert outcomes[1].exception().smtp_code == 550
+    assert outcomes[2].result() == "c@x"
+    assert sorted((to, path) for to, path, _ in scheduler.dead_letters) == [("a@x", "a@x.pdf"), ("b@x", "b@x.pdf")]
+    metrics = scheduler.metrics()
+    assert (metrics["sent"], metrics["failed"], metrics["retries"]) == (1, 2, 2)
+    assert metrics["failure_rate"] == pytest.approx(2 / 3)
+
+
+def test_backoff_delay_is_capped(monkeypatch):
+    delays = []
+    monkeypatch.setattr(mail_scheduler.random, "uniform", lambda lo, hi: delays.append(hi) or 0.0)
+    transport = ScriptedTransport({"a@x": [busy() for _ in range(5)]})
+    scheduler = SendScheduler(transport, max_attempts=6, base_delay=1.0, max_delay=4.0)
+    scheduler.open()
+    scheduler.submit("a@x", "s", "h")
+    scheduler.close()
+    assert delays == [1.0, 2.0, 4.0, 4.0, 4.0]
+
+
+def test_token_bucket_halves_on_pushback_and_recovers(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(mail_scheduler.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(10)
+    bucket.slow_down()
+    assert bucket.rate == 5
+    bucket.slow_down()  # same second: one burst of rejections
+    assert bucket.rate == 5
+    now[0] += 1.0
+    for _ in range(5):
+        bucket.slow_down()
+        now[0] += 1.0
+    assert bucket.rate == bucket.min_rate == 1
+    for _ in range(100):
+        bucket.speed_up()
+    assert bucket.rate == 10
+
+
+def test_token_bucket_paces_after_the_burst(monkeypatch):
+    now = [0.0]
+    slept = []
+    monkeypatch.setattr(mail_scheduler.time, "monotonic", lambda: now[0])
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(mail_scheduler.time, "sleep", sleep)
+    bucket = TokenBucket(4)
+    for _ in range(8):
+        bucket.acquire()
+    assert slept == pytest.approx([0.25] * 4)
@@ -0,0 +1,105 @@
+import socket
+import time
+from email import message_from_bytes
+from email.policy import default
+import pytest
+from mail_transport import SmtpTransport
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller  # noqa: E402
+
+
+class Recorder:
+    # Keeps every message with the SMTP session (connection) it came on
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((session, envelope.mail_from, envelope.rcpt_tos, envelope.content))
+        return "250 OK"
+
+    def sessions(self):
+        return len({id(session) for session, _, _, _ in self.messages})
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server(request):
+    # An aiosmtpd server on localhost; parametrize with its idle timeout
+    handler = Recorder()
+    controller = Controller(handler, hostname="127.0.0.1", port=free_port(),
+                            timeout=getattr(request, "param", 30))
+    controller.start()
+    yield controller, handler
+    controller.stop()
+
+
+def make_transport(controller, **kwargs):
+    transport = SmtpTransport(controller.hostname, controller.port, sender="exams@example.com",
+                              security="none", **kwargs)
+    transport.open()
+    return transport
+
+
+def test_pooled_send_delivers_every_message_over_at_most_the_pool(smtp_server):
+    controller, handler = smtp_server
+    transport = make_transport(controller, connections=4)
+    futures = [transport.submit(f"examinee{i}@school.example", f"Card {i}", f"<p>{i}</p>") for i in range(200)]
+    assert [f.result(timeout=30) for f in futures] == [f"examinee{i}@school.example" for i in range(200)]
+    transport.close()
+    assert len(handler.messages) == 200
+    assert sorted(rcpt[0] for _, _, rcpt, _ in handler.messages) == sorted(f"examinee{i}@school.example"
+                                                                            for i in range(200))
+    assert all(sender == "exams@example.com" for _, sender, _, _ in handler.messages)
+    assert 1 <= handler.sessions() <= 4
+
+
+def test_attachments_round_trip(smtp_server, tmp_path):
+    controller, handler = smtp_server
+    card = tmp_path / "EX001_card.pdf"
+    card.write_bytes(bytes(range(256)) * 300)
+    guide = tmp_path / "guide.txt"
+    guide.write_bytes("Bring your ID — أحضر هويتك\n".encode("utf-8"))
+    transport = make_transport(controller, connections=2)
+    for i in range(3):
+        transport.submit(f"e{i}@school.example", "بطاقة الدخول", "<p>مرحبا</p>", [str(card), str(guide)]).result()
+    transport.close()
+
+    assert transport.attachments.stats()["misses"] == 2
+    for _, _, _, content in handler.messages:
+        msg = message_from_bytes(content, policy=default)
+        assert msg["Subject"] == "بطاقة الدخول"
+        assert "مرحبا" in msg.get_body(("html",)).get_content()
+        parts = {part.get_filename(): part.get_payload(decode=True) for part in msg.iter_attachments()}
+        assert parts == {"EX001_card.pdf": card.read_bytes(), "guide.txt": guide.read_bytes()}
+
+
+@pytest.mark.parametrize("smtp_server", [0.5], indirect=True)
+def test_reconnects_after_the_server_drops_an_idle_connection(smtp_server):
+    controller, handler = smtp_server
+    transport = make_transport(controller, connections=1)
+    transport.submit("a@school.example", "1", "<p>1</p>").result(timeout=10)
+    time.sleep(1.5)  # past the server's idle timeout
+    assert transport.submit("b@school.example", "2", "<p>2</p>").result(timeout=10) == "b@school.example"
+    transport.close()
+    assert len(handler.messages) == 2
+    assert handler.sessions() == 2
+
+
+def test_messages_per_connection_rotates_the_connection(smtp_server):
+    controller, handler = smtp_server
+    transport = make_transport(controller, connections=1, messages_per_connection=5)
+    for i in range(12):
+        transport.submit(f"e{i}@school.example", "s", "<p>x</p>").result(timeout=10)
+    transport.close()
+    assert len(handler.messages) == 12
+    assert handler.sessions() == 3
+    counts = {}
+    for session, _, _, _ in handler.messages:
+        counts[id(session)] = counts.get(id(session), 0) + 1
+    assert sorted(counts.values()) == [2, 5, 5]
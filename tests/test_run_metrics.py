@@ -0,0 +1,37 @@
+import json
+import os
+import pytest
+from run_metrics import CPROFILE_ENV, NULL_METRICS, PROFILE_ENV, run_metrics
+
+
+@pytest.fixture(autouse=True)
+def no_switches(monkeypatch, tmp_path):
+    monkeypatch.delenv(PROFILE_ENV, raising=False)
+    monkeypatch.delenv(CPROFILE_ENV, raising=False)
+    monkeypatch.chdir(tmp_path)
+
+
+def test_off_by_default():
+    assert run_metrics("run") is NULL_METRICS
+
+
+def test_timing_alone_writes_no_profile(tmp_path):
+    metrics = run_metrics("run", str(tmp_path / "out")).start()
+    with metrics.stage("work"):
+        metrics.count("rows", 3)
+    summary = metrics.finish()
+    assert "profile" not in summary
+    assert os.listdir(tmp_path / "out") == [os.path.basename(summary["summary"])]
+    with open(summary["summary"], encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["stages"]["work"]["calls"] == 1
+    assert saved["counters"] == {"rows": 3}
+    assert saved["peak_rss_mb"] > 0
+
+
+@pytest.mark.parametrize("folder", [None, "out"])
+def test_cprofile_is_its_own_switch(monkeypatch, tmp_path, folder):
+    monkeypatch.setenv(CPROFILE_ENV, "1")
+    summary = run_metrics("run", folder).start().finish()
+    assert os.path.dirname(summary["profile"]) == (folder or "run_profiles")
+    assert os.path.exists(summary["profile"]) and os.path.exists(summary["summary"])